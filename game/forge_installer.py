@@ -13,23 +13,19 @@ import os
 import platform
 import re
 import shutil
-import ssl
 import subprocess
 import sys
 import threading
 import time
+import urllib.error
 from datetime import datetime
-
-# SSL context for Ren'Py's bundled Python (lacks system CA certs)
-try:
-    _fi_ssl_ctx = ssl.create_default_context()
-    _fi_ssl_ctx.load_default_certs()
-except Exception:
-    _fi_ssl_ctx = ssl.create_default_context()
-    _fi_ssl_ctx.check_hostname = False
-    _fi_ssl_ctx.verify_mode = ssl.CERT_NONE
 from pathlib import Path
 
+# Shared keep-alive HTTPS client (urllib-based; we can't assume requests is
+# installed in Ren'Py). It also carries the SSL fallback for Ren'Py's
+# bundled Python, which lacks system CA certs.
+import http_pool
+
 # ---------------------------------------------------------------------------
 # Constants
 # ---------------------------------------------------------------------------
@@ -367,13 +363,10 @@ def validate_anthropic_key(key):
     """
     log(f"Validating Anthropic key {_mask_key(key)}")
     try:
-        # Use urllib since we can't assume requests is installed in Ren'Py
-        import urllib.request
-        import urllib.error
-
-        req = urllib.request.Request(
+        http_pool.request(
+            "POST",
             "https://api.anthropic.com/v1/messages",
-            data=json.dumps({
+            body=json.dumps({
                 "model": "claude-sonnet-4-20250514",
                 "max_tokens": 1,
                 "messages": [{"role": "user", "content": "hi"}],
@@ -383,10 +376,8 @@ def validate_anthropic_key(key):
                 "anthropic-version": "2023-06-01",
                 "content-type": "application/json",
             },
-            method="POST",
+            timeout=15,
         )
-
-        resp = urllib.request.urlopen(req, timeout=15, context=_fi_ssl_ctx)
         log("Anthropic key validated successfully")
         return True, ""
 
@@ -417,13 +408,9 @@ def validate_gemini_key(key):
     """
     log(f"Validating Gemini key {_mask_key(key)}")
     try:
-        import urllib.request
-        import urllib.error
-
         # List models endpoint is a lightweight way to verify the key
         url = f"https://generativelanguage.googleapis.com/v1beta/models?key={key}"
-        req = urllib.request.Request(url, method="GET")
-        resp = urllib.request.urlopen(req, timeout=15, context=_fi_ssl_ctx)
+        http_pool.request("GET", url, timeout=15)
         log("Gemini key validated successfully")
         return True, ""
 
@@ -805,8 +792,7 @@ def flat_status():
 def check_online():
     """Quick connectivity check. Returns True if we can reach the internet."""
     try:
-        import urllib.request
-        urllib.request.urlopen("https://registry.npmjs.org", timeout=5, context=_fi_ssl_ctx)
+        http_pool.request("GET", "https://registry.npmjs.org", timeout=5)
         return True
     except Exception:
         return False
@@ -0,0 +1,160 @@
+"""
+Generation Cache — Forge the Kingdom
+Content-addressed on-disk cache for generated portraits and scenes. Entries
+are keyed by a hash of everything that decides the painting — model,
+prompt, aspect ratio and seed — so repainting the same traits or replaying
+a chapter returns the earlier painting instantly instead of spending
+another API call. Least recently used entries are evicted once the cache
+grows past MAX_BYTES.
+
+A hit is copied (hard-linked where possible) to a fresh output file, so
+evicting a cache entry never breaks a gallery or portrait path.
+
+Usage:
+    import generation_cache as gc
+    key = gc.make_key(model, prompt, "16:9", seed)
+    path = gc.fetch(key, SCENE_DIR, "scene_survey_1700000000")  # None on a miss
+    gc.store(key, path)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+# ── Config ────────────────────────────────────────────────────────────────
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "generation_cache")
+INDEX_FILE = "index.json"
+MAX_BYTES = 256 * 1024 * 1024  # total image bytes kept before LRU eviction
+
+_lock = threading.Lock()
+_index = None  # key -> {"file", "size", "used", "created", "model"}
+
+
+def make_key(model, prompt, aspect_ratio, seed=None):
+    """Hash of the request parameters that determine the image."""
+    material = json.dumps([model, prompt, aspect_ratio, seed], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _index_path():
+    return os.path.join(CACHE_DIR, INDEX_FILE)
+
+
+def _load():
+    """The index, read from disk on first use. Call with _lock held."""
+    global _index
+    if _index is None:
+        try:
+            with open(_index_path(), "r") as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+    return _index
+
+
+def _save():
+    """Write the index atomically. Call with _lock held."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = _index_path() + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(_index, f)
+    os.replace(tmp, _index_path())
+
+
+def _link_or_copy(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+def _evict(limit):
+    """Drop least recently used entries until the cache fits in limit bytes."""
+    entries = sorted(_index.items(), key=lambda item: item[1]["used"])
+    total = sum(entry["size"] for _, entry in entries)
+    for key, entry in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, entry["file"]))
+        except OSError:
+            pass
+        total -= entry["size"]
+        del _index[key]
+
+
+def fetch(key, dest_dir, base_name):
+    """Copy the cached image for key to dest_dir/base_name.<ext>.
+
+    Returns the new path, or None on a miss.
+    """
+    with _lock:
+        entry = _load().get(key)
+        if entry is None:
+            return None
+        src = os.path.join(CACHE_DIR, entry["file"])
+        ext = os.path.splitext(entry["file"])[1]
+        dest = os.path.join(dest_dir, base_name + ext)
+        try:
+            os.makedirs(dest_dir, exist_ok=True)
+            _link_or_copy(src, dest)
+        except OSError:
+            # The file went missing behind our back; forget it
+            del _index[key]
+            _save()
+            return None
+        entry["used"] = time.time()
+        _save()
+    return dest
+
+
+def contains(key):
+    """True if key has a cached image (without touching its LRU position)."""
+    with _lock:
+        entry = _load().get(key)
+        return entry is not None and os.path.exists(os.path.join(CACHE_DIR, entry["file"]))
+
+
+def store(key, path, model=None):
+    """Remember the image at path under key, replacing any earlier entry."""
+    ext = os.path.splitext(path)[1]
+    name = key + ext
+    with _lock:
+        index = _load()
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            old = index.pop(key, None)
+            if old is not None:
+                try:
+                    os.remove(os.path.join(CACHE_DIR, old["file"]))
+                except OSError:
+                    pass
+            dest = os.path.join(CACHE_DIR, name)
+            _link_or_copy(path, dest)
+            now = time.time()
+            index[key] = {"file": name, "size": os.path.getsize(dest),
+                          "used": now, "created": now, "model": model}
+            _evict(MAX_BYTES)
+            _save()
+        except OSError as e:
+            print(f"[GenerationCache] Could not cache {os.path.basename(path)}: {e}")
+
+
+def stats():
+    """Entry count and total bytes held."""
+    with _lock:
+        index = _load()
+        return {"entries": len(index), "bytes": sum(e["size"] for e in index.values()),
+                "max_bytes": MAX_BYTES}
+
+
+def clear():
+    """Delete every cached image."""
+    with _lock:
+        _load()
+        _evict(0)
+        _save()
@@ -0,0 +1,342 @@
+"""
+HTTP Pool — Forge the Kingdom
+One shared HTTPS client for every API call the game makes: portraits,
+scenes, key validation and the online check. Connections are kept alive and
+pooled per host, so a portrait followed by several chapter scenes pays for
+one TCP + TLS handshake instead of one per request. Responses are requested
+gzip-encoded and decoded transparently.
+
+Errors are raised as urllib's HTTPError / URLError, so callers handle them
+exactly as they handled urlopen.
+
+Usage:
+    import http_pool
+    http_pool.preconnect("https://generativelanguage.googleapis.com")
+    resp = http_pool.request("POST", url, body=data, headers=headers, timeout=60)
+    result = json.loads(resp.read().decode("utf-8"))
+
+    # Large bodies can be read a chunk at a time instead
+    with http_pool.open_stream("POST", url, body=data, headers=headers) as stream:
+        chunk = stream.read()
+"""
+
+import http.client
+import io
+import select
+import socket
+import ssl
+import threading
+import time
+import zlib
+from collections import deque
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+# ── Config ────────────────────────────────────────────────────────────────
+
+MAX_IDLE_PER_HOST = 4  # idle connections kept per (scheme, host, port)
+IDLE_TIMEOUT = 240  # seconds an idle connection is trusted to still be open
+# Google APIs only gzip responses for user agents that mention gzip
+USER_AGENT = "ForgeTheKingdom (gzip)"
+
+# Certificates are always verified. Ren'Py's bundled Python may not find
+# the system CA store, so certifi's bundle is added when it is available.
+# (get_ca_certs() cannot tell: certificates in a capath directory are only
+# loaded on first use.)
+SSL_CONTEXT = ssl.create_default_context()
+try:
+    import certifi
+    SSL_CONTEXT.load_verify_locations(certifi.where())
+except (ImportError, OSError, ssl.SSLError):
+    pass
+
+# Only for callers that pass insecure_fallback=True, and only for a host
+# whose certificate has actually failed verification
+_UNVERIFIED_CONTEXT = ssl.create_default_context()
+_UNVERIFIED_CONTEXT.check_hostname = False
+_UNVERIFIED_CONTEXT.verify_mode = ssl.CERT_NONE
+
+# Errors that mean a pooled connection was closed by the server while idle
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                 ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+# Safe to send again when a reused connection drops before the response:
+# the server may already have acted on them, but repeating does no harm
+_IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+_pool = {}  # (scheme, host, port, unverified) -> deque of (connection, idle since)
+_unverified_hosts = set()  # (scheme, host, port) that failed verification
+_pool_lock = threading.Lock()
+_stats = {"connects": 0, "reused": 0, "retries": 0}
+
+
+class Response:
+    """A finished response: status, headers and the decoded body."""
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._body = body
+
+    def read(self):
+        return self._body
+
+    def getcode(self):
+        return self.status
+
+
+def _key(url, insecure_fallback=False):
+    """Pool key for url. Unverified connections are pooled apart, so a
+    verifying caller never reuses one."""
+    parts = urlsplit(url)
+    scheme = parts.scheme or "https"
+    port = parts.port or (443 if scheme == "https" else 80)
+    host = (scheme, parts.hostname, port)
+    return host + (insecure_fallback and host in _unverified_hosts,)
+
+
+def _unverified(key):
+    """Note that key's host failed verification; the key to use instead."""
+    print(f"[HttpPool] Certificate for {key[1]} could not be verified; "
+          f"continuing without verification")
+    _unverified_hosts.add(key[:3])
+    return key[:3] + (True,)
+
+
+def _connect(key, timeout):
+    scheme, host, port, unverified = key
+    if scheme == "https":
+        context = _UNVERIFIED_CONTEXT if unverified else SSL_CONTEXT
+        conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=context)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    conn.connect()
+    with _pool_lock:
+        _stats["connects"] += 1
+    return conn
+
+
+def _checkout(key):
+    """An idle pooled connection for key, or None."""
+    now = time.monotonic()
+    with _pool_lock:
+        idle = _pool.get(key)
+        while idle:
+            conn, since = idle.pop()
+            if now - since < IDLE_TIMEOUT and not _dropped(conn):
+                _stats["reused"] += 1
+                return conn
+            conn.close()
+    return None
+
+
+def _dropped(conn):
+    """True if the server has closed an idle connection. An idle socket
+    should have nothing to read, so a readable one is at EOF (or holds
+    stray bytes) and cannot carry another request."""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def _checkin(key, conn):
+    with _pool_lock:
+        idle = _pool.setdefault(key, deque())
+        idle.append((conn, time.monotonic()))
+        while len(idle) > MAX_IDLE_PER_HOST:
+            idle.popleft()[0].close()
+
+
+def _decompressor(encoding):
+    """An incremental decoder for a Content-Encoding, or None for identity."""
+    encoding = (encoding or "").lower()
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    return None
+
+
+class StreamingResponse:
+    """A response whose body is read (and decoded) a chunk at a time.
+
+    The connection goes back to the pool once the body has been read to the
+    end; closing early drops it instead.
+    """
+
+    def __init__(self, key, conn, resp):
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self._decoder = _decompressor(resp.getheader("Content-Encoding"))
+        self._eof = False
+
+    def read(self, size=65536):
+        """Up to size raw bytes from the wire, decoded; b"" at the end."""
+        while not self._eof:
+            try:
+                raw = self._resp.read(size)
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                raise URLError(e)
+            if not raw:
+                self._eof = True
+                data = self._decoder.flush() if self._decoder else b""
+                self._release()
+                return data
+            data = self._decoder.decompress(raw) if self._decoder else raw
+            if data:
+                return data
+        return b""
+
+    def read_all(self):
+        chunks = []
+        while True:
+            data = self.read()
+            if not data:
+                return b"".join(chunks)
+            chunks.append(data)
+
+    def _release(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._resp.will_close:
+            conn.close()
+        else:
+            _checkin(self._key, conn)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_stream(method, url, body=None, headers=None, timeout=60, insecure_fallback=False):
+    """Send one request over a pooled connection and return its
+    StreamingResponse once the headers have arrived.
+
+    Raises HTTPError for 4xx/5xx answers (its read() returns the decoded
+    body) and URLError when the host cannot be reached or its certificate
+    fails verification. With insecure_fallback, a failed verification is
+    retried (and later requests to that host sent) without it.
+    """
+    key = _key(url, insecure_fallback)
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    send_headers = {"Accept-Encoding": "gzip", "User-Agent": USER_AGENT,
+                    "Connection": "keep-alive"}
+    send_headers.update(headers or {})
+
+    conn = _checkout(key)
+    while True:
+        reused = conn is not None
+        sent = False
+        try:
+            if conn is None:
+                conn = _connect(key, timeout)
+            else:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+            conn.request(method, path, body=body, headers=send_headers)
+            sent = True
+            resp = conn.getresponse()
+            break
+        except _STALE_ERRORS as e:
+            if conn is not None:
+                conn.close()
+            conn = None
+            # A reused connection the server had closed while idle: retry on a
+            # fresh one, unless the request went out and resending it (a POST
+            # that may already have run) could act on it twice
+            if not reused or (sent and method.upper() not in _IDEMPOTENT_METHODS):
+                raise URLError(e)
+            with _pool_lock:
+                _stats["retries"] += 1
+        except ssl.SSLCertVerificationError as e:
+            if conn is not None:
+                conn.close()
+            conn = None
+            if not insecure_fallback or key[3]:
+                raise URLError(e)
+            key = _unverified(key)
+        except (OSError, http.client.HTTPException) as e:
+            if conn is not None:
+                conn.close()
+            if isinstance(e, socket.timeout):
+                raise URLError("timed out")
+            raise URLError(e)
+
+    stream = StreamingResponse(key, conn, resp)
+    if resp.status >= 400:
+        data = stream.read_all()
+        raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+    return stream
+
+
+def request(method, url, body=None, headers=None, timeout=60, insecure_fallback=False):
+    """Send one request over a pooled connection and return a Response.
+
+    Raises HTTPError for 4xx/5xx answers (its read() returns the decoded
+    body) and URLError when the host cannot be reached; see open_stream().
+    """
+    stream = open_stream(method, url, body=body, headers=headers, timeout=timeout,
+                         insecure_fallback=insecure_fallback)
+    data = stream.read_all()
+    return Response(stream.status, stream.reason, stream.headers, data)
+
+
+def preconnect(url, timeout=10, insecure_fallback=False):
+    """Open a connection to url's host in the background and pool it.
+
+    Call when a request is likely soon (the character creator opening), so
+    the handshake is already done when the player presses Generate.
+    """
+    key = _key(url, insecure_fallback)
+
+    def _open():
+        k = key
+        try:
+            try:
+                conn = _connect(k, timeout)
+            except ssl.SSLCertVerificationError:
+                if not insecure_fallback or k[3]:
+                    raise
+                k = _unverified(k)
+                conn = _connect(k, timeout)
+            _checkin(k, conn)
+        except Exception as e:
+            print(f"[HttpPool] Pre-connect to {key[1]} failed: {e}")
+
+    threading.Thread(target=_open, daemon=True, name="HttpPoolPreconnect").start()
+
+
+def stats():
+    """Counts of new connections, reused connections and stale retries."""
+    with _pool_lock:
+        return dict(_stats, idle=sum(len(idle) for idle in _pool.values()))
+
+
+def close_all():
+    """Close every idle connection."""
+    with _pool_lock:
+        for idle in _pool.values():
+            for conn, _ in idle:
+                conn.close()
+        _pool.clear()
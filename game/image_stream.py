@@ -0,0 +1,166 @@
+"""
+Image Stream — Forge the Kingdom
+Pulls the image out of a Gemini or Imagen JSON response while it downloads.
+The response is scanned a chunk at a time for the first `inlineData.data` /
+`bytesBase64Encoded` string, whose base64 is decoded straight into a temp
+file next to the destination; everything else is kept as a small JSON
+skeleton and parsed normally. A 4K scene never exists in memory as one
+string, let alone three.
+
+Usage:
+    import image_stream
+    with http_pool.open_stream("POST", url, body=data, headers=headers) as stream:
+        result, tmp_path = image_stream.extract(stream, SCENE_DIR)
+    # result is the parsed response, the image string replaced by STREAMED
+    image_stream.commit(tmp_path, output_path)
+"""
+
+import base64
+import codecs
+import json
+import os
+import re
+import tempfile
+
+# Stands in for the streamed base64 string in the parsed response
+STREAMED = "<streamed>"
+
+CHUNK_SIZE = 64 * 1024
+
+# An image-carrying key and the quote opening its value. The key's own quote
+# must not be escaped, or it is text inside another string.
+_FIELD_RE = re.compile(r'(?<!\\)"(data|bytesBase64Encoded)"\s*:\s*"')
+_FIELD_MAX = 40  # longest match, kept across chunk boundaries
+
+
+class _Base64Sink:
+    """Decodes base64 text fed in arbitrary pieces and writes the bytes."""
+
+    def __init__(self, f):
+        self.f = f
+        self.pending = ""
+        self.size = 0
+
+    def feed(self, text):
+        # JSON may escape "/" as "\/"; base64 itself has no backslashes
+        text = self.pending + text.replace("\\", "")
+        cut = len(text) - len(text) % 4
+        self.pending = text[cut:]
+        if cut:
+            data = base64.b64decode(text[:cut])
+            self.f.write(data)
+            self.size += len(data)
+
+    def close(self):
+        if self.pending:
+            data = base64.b64decode(self.pending + "=" * (-len(self.pending) % 4))
+            self.f.write(data)
+            self.size += len(data)
+            self.pending = ""
+
+
+def extract(stream, dest_dir):
+    """Read a JSON response from stream, decoding its first image to disk.
+
+    stream is anything with read(size) returning bytes (b"" at the end).
+    Returns (result, tmp_path): the parsed JSON with the image string
+    replaced by STREAMED (any later image strings by ""), and the temp file
+    in dest_dir holding the decoded image, or None if there was no image.
+    Raises ValueError if the JSON or the base64 is malformed (binascii.Error
+    is a ValueError); the temp file is removed then.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    skeleton = []
+    tail = ""  # end of the skeleton text that may hold the start of a key
+    in_value = False
+    escaped = False  # the value text so far ends in an odd run of backslashes
+    sink = None
+    fd, tmp_path = tempfile.mkstemp(prefix=".download-", suffix=".part", dir=dest_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                raw = stream.read(CHUNK_SIZE)
+                text = decoder.decode(raw, final=not raw)
+                while text:
+                    if in_value:
+                        end = _value_end(text, escaped)
+                        piece = text if end < 0 else text[:end]
+                        if sink.f is f:
+                            sink.feed(piece)
+                        if end < 0:
+                            escaped = _odd_backslashes(text, escaped)
+                            break
+                        in_value = escaped = False
+                        if sink.f is f and not sink.size and not sink.pending:
+                            pass  # an empty image string; keep looking
+                        elif sink.f is f:
+                            sink.close()
+                            sink.f = None  # only the first image is kept
+                            skeleton.append(STREAMED)
+                        text = text[end:]  # the closing quote stays in the skeleton
+                    else:
+                        text = tail + text
+                        match = _FIELD_RE.search(text)
+                        if match is None:
+                            keep = min(len(text), _FIELD_MAX)
+                            skeleton.append(text[:len(text) - keep])
+                            tail = text[len(text) - keep:]
+                            break
+                        skeleton.append(text[:match.end()])
+                        tail = ""
+                        text = text[match.end():]
+                        in_value = True
+                        if sink is None:
+                            sink = _Base64Sink(f)
+                if not raw:
+                    break
+        if in_value:
+            raise ValueError("Response ended inside the image data")
+        skeleton.append(tail)
+        result = json.loads("".join(skeleton))
+    except BaseException:
+        discard(tmp_path)
+        raise
+    if sink is None or sink.f is not None:
+        discard(tmp_path)
+        return result, None
+    return result, tmp_path
+
+
+def _odd_backslashes(text, escaped):
+    """Whether text ends in an unpaired backslash, given the state before it."""
+    run = len(text) - len(text.rstrip("\\"))
+    if run == len(text):
+        return escaped != (run % 2 == 1)
+    return run % 2 == 1
+
+
+def _value_end(text, escaped):
+    """Index of the unescaped closing quote in text, or -1."""
+    i = 0
+    while True:
+        i = text.find('"', i)
+        if i < 0:
+            return -1
+        # Count the backslashes right before the quote
+        j = i
+        while j > 0 and text[j - 1] == "\\":
+            j -= 1
+        backslashes = i - j + (1 if escaped and j == 0 else 0)
+        if backslashes % 2 == 0:
+            return i
+        i += 1
+
+
+def commit(tmp_path, path):
+    """Move a finished download into place atomically."""
+    os.replace(tmp_path, path)
+
+
+def discard(tmp_path):
+    """Remove a temp file if it is still there."""
+    if tmp_path:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
@@ -10,28 +10,20 @@ Usage (from Ren'Py):
 
 import os
 import json
-import base64
 import time
 import traceback
 
-# Use urllib since requests may not be available in Ren'Py's Python
+import generation_cache
+import image_stream
+import rate_limiter
+
+# Pooled keep-alive HTTPS client; urllib-based, since requests may not be
+# available in Ren'Py's Python
 try:
-    from urllib.request import Request, urlopen
+    import http_pool
     from urllib.error import HTTPError, URLError
-    import ssl
-    # Ren'Py's bundled Python may not have system CA certs
-    try:
-        _ssl_ctx = ssl.create_default_context()
-        # Test if default context works by checking it has CA certs
-        if not _ssl_ctx.get_ca_certs():
-            raise Exception("No CA certs")
-    except Exception:
-        _ssl_ctx = ssl.create_default_context()
-        _ssl_ctx.check_hostname = False
-        _ssl_ctx.verify_mode = ssl.CERT_NONE
     HAS_URLLIB = True
 except ImportError:
-    _ssl_ctx = None
     HAS_URLLIB = False
 
 # ── Config ────────────────────────────────────────────────────────────────
@@ -43,6 +35,7 @@ GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model
 IMAGEN_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:predict"
 PORTRAIT_DIR = os.path.join(os.path.dirname(__file__), "images", "char", "custom")
 TIMEOUT = 60  # seconds
+ASPECT_RATIO = "3:4"
 
 # ── Trait Definitions ─────────────────────────────────────────────────────
 
@@ -113,10 +106,22 @@ def build_prompt(traits):
 
 # ── API Call ──────────────────────────────────────────────────────────────
 
-def generate_portrait(traits, api_key, filename=None, model=None):
+def preconnect():
+    """Warm a connection to the Gemini API in the background (best effort)."""
+    if HAS_URLLIB:
+        http_pool.preconnect(GEMINI_API_URL, insecure_fallback=True)
+
+
+def generate_portrait(traits, api_key, filename=None, model=None, seed=None, reroll=False,
+                      ticket=None):
     """
     Generate a portrait using Gemini's image generation.
 
+    The same traits, model and seed return the cached painting without an
+    API call; reroll=True always paints a new one (and caches it instead).
+    Requests wait their turn under the model's rate limit; pass a
+    rate_limiter.Ticket to follow the wait.
+
     Returns: (success: bool, path_or_error: str)
         On success: (True, absolute_path_to_image)
         On failure: (False, error_message)
@@ -144,6 +149,12 @@ def generate_portrait(traits, api_key, filename=None, model=None):
     _model = model if model else GEMINI_MODEL_25
     is_imagen = _model.startswith("imagen")
 
+    cache_key = generation_cache.make_key(_model, prompt, ASPECT_RATIO, seed)
+    if not reroll:
+        cached = generation_cache.fetch(cache_key, PORTRAIT_DIR, os.path.splitext(filename)[0])
+        if cached:
+            return True, cached
+
     if is_imagen:
         url = IMAGEN_API_URL.format(model=_model) + f"?key={api_key}"
         payload = {
@@ -152,10 +163,12 @@ def generate_portrait(traits, api_key, filename=None, model=None):
             ],
             "parameters": {
                 "sampleCount": 1,
-                "aspectRatio": "3:4",
+                "aspectRatio": ASPECT_RATIO,
                 "outputOptions": {"mimeType": "image/png"},
             }
         }
+        if seed is not None:
+            payload["parameters"]["seed"] = seed
     else:
         url = GEMINI_API_URL.format(model=_model) + f"?key={api_key}"
         payload = {
@@ -171,16 +184,28 @@ def generate_portrait(traits, api_key, filename=None, model=None):
                 "temperature": 1.0,
             }
         }
+        if seed is not None:
+            payload["generationConfig"]["seed"] = seed
 
     headers = {
         "Content-Type": "application/json",
     }
 
+    tmp_path = None
     try:
         data = json.dumps(payload).encode("utf-8")
-        req = Request(url, data=data, headers=headers, method="POST")
-        response = urlopen(req, timeout=TIMEOUT, context=_ssl_ctx)
-        result = json.loads(response.read().decode("utf-8"))
+
+        def _send():
+            # The image is decoded to a temp file as it downloads; result
+            # holds image_stream.STREAMED in its place. As before the pool,
+            # a certificate that cannot be verified (no CA store in Ren'Py's
+            # Python) is retried without verification.
+            with http_pool.open_stream("POST", url, body=data, headers=headers,
+                                       timeout=TIMEOUT, insecure_fallback=True) as response:
+                return image_stream.extract(response, PORTRAIT_DIR)
+
+        # Waits its turn under the model's per-minute limit; 429s are retried
+        result, tmp_path = rate_limiter.call(_model, api_key, _send, ticket=ticket)
 
         # Extract image from response — Imagen uses different format
         if is_imagen:
@@ -191,13 +216,12 @@ def generate_portrait(traits, api_key, filename=None, model=None):
             mime = predictions[0].get("mimeType", "image/png")
             if not b64_data:
                 return False, "No image data in Imagen response"
-            img_bytes = base64.b64decode(b64_data)
             ext = "png" if "png" in mime else "jpg"
             base = os.path.splitext(filename)[0]
             filename = f"{base}.{ext}"
             output_path = os.path.join(PORTRAIT_DIR, filename)
-            with open(output_path, "wb") as f:
-                f.write(img_bytes)
+            image_stream.commit(tmp_path, output_path)
+            generation_cache.store(cache_key, output_path, _model)
             return True, output_path
 
         candidates = result.get("candidates", [])
@@ -215,9 +239,6 @@ def generate_portrait(traits, api_key, filename=None, model=None):
                 if not b64_data:
                     continue
 
-                # Decode and save
-                img_bytes = base64.b64decode(b64_data)
-
                 # Determine extension from mime
                 ext = "png"
                 if "jpeg" in mime or "jpg" in mime:
@@ -230,9 +251,9 @@ def generate_portrait(traits, api_key, filename=None, model=None):
                 filename = f"{base}.{ext}"
                 output_path = os.path.join(PORTRAIT_DIR, filename)
 
-                with open(output_path, "wb") as f:
-                    f.write(img_bytes)
+                image_stream.commit(tmp_path, output_path)
 
+                generation_cache.store(cache_key, output_path, _model)
                 return True, output_path
 
         return False, "No image data in response"
@@ -251,6 +272,9 @@ def generate_portrait(traits, api_key, filename=None, model=None):
     except Exception as e:
         return False, f"Unexpected error: {str(e)}\n{traceback.format_exc()}"
 
+    finally:
+        image_stream.discard(tmp_path)
+
 
 # ── Key Detection ─────────────────────────────────────────────────────────
 
@@ -0,0 +1,223 @@
+"""
+Rate Limiter — Forge the Kingdom
+Client-side request pacing for the image models, which allow only 5-10
+requests a minute per key. Each (model, API key) pair gets a token bucket
+and a first-come-first-served queue; a 429 empties the bucket and pauses it
+for the server's Retry-After (or an exponential backoff), then the request
+is retried. Bursts of repaints and scene offers wait their turn instead of
+failing with "API error 429".
+
+A Ticket follows one request through the queue so screens can show its
+place in line and an estimated wait.
+
+Usage:
+    import rate_limiter
+    ticket = rate_limiter.Ticket()
+    result = rate_limiter.call(model, api_key, send, ticket=ticket)
+    ticket.describe()  # "Third in line — about 14 s" while it waits
+"""
+
+import hashlib
+import random
+import threading
+import time
+from urllib.error import HTTPError
+
+# ── Config ────────────────────────────────────────────────────────────────
+
+# Requests per minute; mirrors MODEL_HINTS in webapp/app.js
+MODEL_RPM = {
+    "gemini-3-pro-image-preview": 10,
+    "gemini-2.5-flash-image": 10,
+    "gemini-2.0-flash-exp-image-generation": 10,
+    "imagen-4.0-ultra-generate-001": 5,
+}
+DEFAULT_RPM = 5  # models without a published limit
+MAX_RETRIES = 4  # 429 / 503 answers retried before giving up
+BACKOFF_BASE = 5.0  # seconds; doubled for each consecutive 429
+BACKOFF_MAX = 120.0
+RETRY_STATUSES = (429, 503)
+
+_ORDINALS = ("Next", "Second", "Third", "Fourth", "Fifth")
+
+
+class Ticket:
+    """One request's place in a bucket's queue, readable from screens."""
+
+    def __init__(self):
+        self.state = "new"  # new, queued, backoff, sending, done
+        self.position = None  # 0-based place in line while queued
+        self.ready_at = None  # monotonic time the request is expected to go
+        self.attempt = 0
+
+    @property
+    def waiting(self):
+        return self.state in ("queued", "backoff")
+
+    def eta(self):
+        """Seconds until the request is expected to be sent, or None."""
+        if not self.waiting or self.ready_at is None:
+            return None
+        return max(0.0, self.ready_at - time.monotonic())
+
+    def describe(self):
+        """A short line for the painting screens; "" when not waiting."""
+        eta = self.eta()
+        if eta is None:
+            return ""
+        wait = "about %d s" % max(1, round(eta))
+        if self.state == "backoff":
+            return "The crystal needs a rest — retrying in %s" % wait
+        if not self.position:
+            return "Waiting for the crystal — %s" % wait
+        place = _ORDINALS[self.position] if self.position < len(_ORDINALS) else "#%d" % (self.position + 1)
+        return "%s in line — %s" % (place, wait)
+
+
+class _Bucket:
+    """Token bucket plus FIFO queue for one model and key."""
+
+    def __init__(self, rpm):
+        self.capacity = float(rpm)
+        self.rate = rpm / 60.0  # tokens per second
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.failures = 0
+        self.queue = []  # Tickets, first in line first
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def ready_at(self, position, now):
+        """When the ticket at position can expect a token."""
+        start = max(now, self.paused_until)
+        missing = position + 1 - self.tokens
+        if start > now:
+            # Paused: the bucket is empty and refills from the end of the pause
+            missing = position + 1
+        return start + max(0.0, missing) / self.rate
+
+    def update(self, now):
+        for position, ticket in enumerate(self.queue):
+            ticket.position = position
+            ticket.ready_at = self.ready_at(position, now)
+            ticket.state = "backoff" if self.paused_until > now else "queued"
+
+
+_cond = threading.Condition()
+_buckets = {}
+
+
+def _bucket(model, api_key):
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+    key = (model, digest)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = _buckets[key] = _Bucket(MODEL_RPM.get(model, DEFAULT_RPM))
+    return bucket
+
+
+def acquire(model, api_key, ticket=None, timeout=None):
+    """Wait for this request's turn and take a token.
+
+    Returns False if timeout (seconds) ran out first.
+    """
+    ticket = ticket or Ticket()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _cond:
+        bucket = _bucket(model, api_key)
+        bucket.queue.append(ticket)
+        try:
+            while True:
+                now = time.monotonic()
+                bucket.refill(now)
+                if (bucket.queue[0] is ticket and now >= bucket.paused_until
+                        and bucket.tokens >= 1.0):
+                    bucket.tokens -= 1.0
+                    ticket.state = "sending"
+                    ticket.position = ticket.ready_at = None
+                    return True
+                bucket.update(now)
+                wait = ticket.ready_at - now if bucket.queue[0] is ticket else 1.0
+                if deadline is not None:
+                    if now >= deadline:
+                        ticket.state = "done"
+                        return False
+                    wait = min(wait, deadline - now)
+                _cond.wait(max(0.01, wait))
+        finally:
+            bucket.queue.remove(ticket)
+            bucket.update(time.monotonic())
+            _cond.notify_all()
+
+
+def _retry_after(error):
+    """Seconds from a Retry-After header (delta form), or None."""
+    value = error.headers.get("Retry-After") if error.headers else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def report(model, api_key, status, retry_after=None):
+    """Tell the limiter how a request went; a 429 or 503 pauses the bucket.
+
+    Returns the pause in seconds (0 for a success).
+    """
+    with _cond:
+        bucket = _bucket(model, api_key)
+        if status not in RETRY_STATUSES:
+            bucket.failures = 0
+            return 0.0
+        bucket.failures += 1
+        backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (bucket.failures - 1))
+        backoff *= random.uniform(0.8, 1.2)
+        pause = max(backoff, retry_after or 0.0)
+        now = time.monotonic()
+        bucket.paused_until = max(bucket.paused_until, now + pause)
+        bucket.tokens = 0.0
+        bucket.updated = bucket.paused_until
+        bucket.update(now)
+        _cond.notify_all()
+        return pause
+
+
+def call(model, api_key, send, ticket=None, retries=MAX_RETRIES):
+    """Run send() in turn for (model, api_key), retrying 429 / 503 answers.
+
+    send raises urllib's HTTPError for error statuses, as http_pool does;
+    the last one is re-raised once retries run out.
+    """
+    ticket = ticket or Ticket()
+    try:
+        while True:
+            ticket.attempt += 1
+            acquire(model, api_key, ticket)
+            try:
+                result = send()
+            except HTTPError as e:
+                pause = report(model, api_key, e.code, _retry_after(e))
+                if e.code not in RETRY_STATUSES or ticket.attempt > retries:
+                    raise
+                print("[RateLimiter] %s answered %d; retrying in %.0f s" % (model, e.code, pause))
+                continue
+            report(model, api_key, 200)
+            return result
+    finally:
+        ticket.state = "done"
+        ticket.position = ticket.ready_at = None
+
+
+def headroom(model, api_key):
+    """Tokens available right now with nobody waiting (0 while paused)."""
+    with _cond:
+        bucket = _bucket(model, api_key)
+        now = time.monotonic()
+        bucket.refill(now)
+        if bucket.queue or now < bucket.paused_until:
+            return 0.0
+        return bucket.tokens
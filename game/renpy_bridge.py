@@ -1,20 +1,191 @@
 """
 Game Pilot Bridge — Ren'Py TCP Interface
-Exposes game state over localhost:47201 for AI control.
-JSON-over-TCP, one object per line.
+Exposes game state over localhost:47201 (or a configured port or Unix
+socket) for AI control.
+JSON-over-TCP, one object per line; every request must end with a newline.
+
+All clients are multiplexed on a single selector-driven I/O thread. Commands
+run on a worker pool: in order per connection, or concurrently when a read
+is tagged with an `id`. See GAME-PILOT.md for limits and measurements.
 
 Built by Linus 🔧 for Anna's Game Pilot system.
 """
 
+import base64
+import collections
+import copy
+import io
 import json
+import os
+import selectors
 import socket
+import struct
+import tempfile
 import threading
+import time
 import traceback
-import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import script_graph
+
+_AF_UNIX = getattr(socket, "AF_UNIX", None)
+
+# Pillow is optional: it adds WebP and faster JPEG encoding for screenshots
+try:
+    from PIL import Image as _PILImage
+    HAS_PIL = True
+except ImportError:
+    _PILImage = None
+    HAS_PIL = False
 
 PORT = 47201
 HOST = "127.0.0.1"
 
+# Per-instance overrides, so several headless games can run side by side.
+# GAME_PILOT_PORT takes a port, "0" for any free port, or a range such as
+# "47201-47210" (first free one wins). GAME_PILOT_SOCKET binds a Unix socket
+# instead of TCP. Each running bridge writes <pid>.json into the discovery
+# directory; see discover().
+ENV_PORT = "GAME_PILOT_PORT"
+ENV_HOST = "GAME_PILOT_HOST"
+ENV_SOCKET = "GAME_PILOT_SOCKET"
+ENV_INSTANCE = "GAME_PILOT_INSTANCE"
+ENV_DISCOVERY_DIR = "GAME_PILOT_DISCOVERY_DIR"
+DISCOVERY_DIR = os.path.join(tempfile.gettempdir(), "game-pilot")
+
+# Win32 constants for the discovery liveness check
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+ERROR_ACCESS_DENIED = 5
+STILL_ACTIVE = 259
+
+# Connection limits for the selector loop. Clients past MAX_CONNECTIONS get
+# a single error line and are closed; silent clients with no request in
+# flight are dropped after CLIENT_IDLE_TIMEOUT seconds (same as the old
+# per-socket recv timeout).
+MAX_CONNECTIONS = 64
+LISTEN_BACKLOG = 128
+CLIENT_IDLE_TIMEOUT = 10.0
+RECV_SIZE = 65536
+
+# Longest newline-delimited request accepted. Longer lines get an error and
+# are skipped up to the next newline.
+MAX_MESSAGE_SIZE = 1 << 20
+
+# How long a command waits for the Ren'Py main thread to run it
+MAIN_THREAD_TIMEOUT = 10.0
+
+# Upper bound for a client's `deadline_ms`
+MAX_DEADLINE = 60.0
+
+# Subscribers whose unsent output grows past this are disconnected rather
+# than letting a stalled pilot buffer events forever.
+MAX_PENDING_OUTPUT = 1 << 20
+
+# Event types a `subscribe` client can filter on
+EVENT_TYPES = ("say", "say_end", "choices", "label", "variable")
+
+# Framed protocol (negotiated with `hello`): a 1-byte frame type, possibly
+# OR'd with FLAG_ZLIB, then a 4-byte big-endian payload length.
+FRAME_HEADER = struct.Struct("!BI")
+FRAME_JSON = 0x01
+FRAME_BINARY = 0x02
+FLAG_ZLIB = 0x80
+MAX_FRAME_SIZE = 16 << 20
+COMPRESS_THRESHOLD = 1024
+COMPRESS_LEVEL = 1
+
+# Commands that can run inside a `batch` (everything that is not bound to
+# the connection itself)
+BATCH_COMMANDS = (
+    "ping", "state", "choices", "choose", "advance",
+    "variables", "set_variable", "screenshot", "jump", "turbo", "history",
+    "checkpoint",
+)
+
+# Commands tagged with an `id` that may run concurrently and answer out of
+# order; everything else is serialised per connection
+CONCURRENT_COMMANDS = (
+    "ping", "state", "choices", "variables", "screenshot", "metrics", "history",
+    "labels", "graph",
+)
+COMMAND_WORKERS = 8
+
+# Rolling window of samples kept per command for `metrics` percentiles.
+# GAME_PILOT_METRICS names a JSONL file that stop() appends a snapshot to.
+METRICS_WINDOW = 2048
+METRICS_MAX_COMMANDS = 64
+ENV_METRICS = "GAME_PILOT_METRICS"
+
+# Transcript of say lines, labels and choices kept for `history`, the most
+# entries one page returns, and GAME_PILOT_HISTORY: a JSONL file every
+# entry is also appended to
+HISTORY_SIZE = 2000
+HISTORY_PAGE = 200
+ENV_HISTORY = "GAME_PILOT_HISTORY"
+
+# run_until: default and maximum run time, default line cap, and how long
+# to wait without progress before dismissing again
+AUTORUN_TIMEOUT = 30.0
+AUTORUN_MAX_TIMEOUT = 300.0
+AUTORUN_MAX_LINES = 500
+AUTORUN_NUDGE = 0.5
+AUTORUN_POLL = 0.05
+
+# Turbo mode: timed pauses and auto-dismiss timers shrink to TURBO_DELAY,
+# transitions and text speed are switched off, and music/sound play calls
+# are dropped. GAME_PILOT_TURBO=1 turns it on at launch.
+TURBO_DELAY = 0.01
+ENV_TURBO = "GAME_PILOT_TURBO"
+
+# Commands that change game state; the main thread republishes the state
+# snapshot after running one
+MUTATING_COMMANDS = ("choose", "advance", "set_variable", "jump")
+
+# Read commands answered from the state snapshot without a main-thread hop,
+# and the cap on extra store variables `variables` may add to the snapshot
+SNAPSHOT_COMMANDS = ("state", "choices", "variables")
+MAX_SNAPSHOT_VARS = 256
+
+# Checkpoints: how many may be kept, the save-slot prefix used with
+# store "slot", and the persistent flags saved and restored with each one
+# (persistent data lives outside Ren'Py saves)
+MAX_CHECKPOINTS = 64
+CHECKPOINT_SLOT_PREFIX = "pilot-"
+CHECKPOINT_PERSISTENT = [
+    "install_mode", "install_step", "onboarding_complete",
+    "character_created", "character_traits", "custom_portrait_path",
+    "companion_enabled", "companion_introduced", "side_quests_done",
+    "found_blank_painting", "found_vulnerability_truth", "found_meta_painting",
+    "asked_vulnerability", "rejected_crown", "game_complete",
+    "openclaw_installed", "anthropic_configured", "gemini_configured",
+    "crons_configured", "kingdom_verified", "scene_model_choice",
+    "has_gemini_for_portraits",
+]
+
+# Shared-memory segment used by `screenshot` with mode "shm" unless the
+# client names its own. Each segment starts with a header of a sequence
+# number (odd while a frame is being written) and the frame size; the
+# frame follows at SHM_HEADER.size.
+DEFAULT_SHM_NAME = "game_pilot_screenshot"
+SHM_HEADER = struct.Struct("<QQ")
+
+# Screenshot encoding: formats, default lossy quality and worker threads
+SCREENSHOT_FORMATS = ("png", "jpeg", "webp")
+DEFAULT_QUALITY = 85
+ENCODE_WORKERS = 2
+
+# Store variables reported by `state` and watched for `variable` events
+KEY_VARS = [
+    "kingdom_name", "player_name", "player_title",
+    "chapter", "quest_log", "forge_lit", "gateway_raised",
+    "coronation_complete", "merith_awakened"
+]
+
+# Nesting depth copied from store lists and dicts; anything deeper (or a
+# self-referencing container) is reported as its string form
+JSONABLE_DEPTH = 32
+
 # Global state tracked via hooks
 _current_speaker = None
 _current_dialogue = None
@@ -23,11 +194,255 @@ _choice_result = None
 _choice_event = threading.Event()
 _server_thread = None
 _running = False
+_hooks_installed = False
+_listen_config = {}  # overrides passed to start()
+_address = None  # where the bridge is actually listening
+_discovery_path = None
+
+# Selector loop state, owned by the GamePilot I/O thread
+_selector = None
+_waker_r = None
+_waker_w = None
+_clients = {}
+
+# Push subscriptions and command results: other threads append to _outbox,
+# the I/O thread drains it after a wake-up.
+_sub_lock = threading.Lock()
+_subscribers = {}  # _Client -> set of event types
+_outbox = []  # (_Client, payload, switch to framed after sending, _Sample)
+_watches = {}  # _Client -> store variables it asked to watch
+_watched = frozenset(KEY_VARS)  # KEY_VARS plus every subscriber's watches
+_watch_values = {}
+_last_choices = None
+_last_label = None  # last label entered, per the label callback
+_autorun = None  # the active run_until, if any
+_original_menu = None  # store.menu before _menu wrapped it
+
+# Turbo mode state. The wrappers stay installed once made; they only act
+# while _turbo is set.
+_turbo = False
+_turbo_pending = None  # requested before the main thread could apply it
+_turbo_saved = {}  # preferences to restore when turbo is switched off
+_turbo_wrapped = False
+
+# State snapshot: the hooks capture label, speaker, dialogue, choices and
+# store variables on the main thread and swap a new dict in under
+# _state_lock; read commands are served from it on any thread. A published
+# snapshot is never mutated. Every field remembers the version at which it
+# last changed, for `since_version` diffs.
+_state_lock = threading.Lock()
+_state_version = 0
+_snapshot = None  # {"version", "state", "store", "tracked"}
+_snapshot_vars = set()  # store variables read by `variables` outside KEY_VARS
+_state_fields = {}  # "label", "choices", ..., "variables.<name>" -> value
+_field_versions = {}  # same keys -> version of last change
+
+# Main-thread dispatch queue: _safe_main_thread appends a _MainCall, and the
+# queue is drained at the start of every interaction and by one
+# invoke_in_main_thread kick whenever it goes from empty to non-empty
+_main_lock = threading.Lock()
+_main_queue = collections.deque()
+_main_kicked = False
+_inflight = {}  # (_Client, request id) -> _MainCall or _AutoRun, for `cancel`
+_pending_unwind = None  # jump/load exception re-raised once its reply is ready
+
+_checkpoints = {}  # name -> {"store", "data" or "slot", "persistent", ...}
+
+# Label index and jump/call graph of the .rpy sources (see script_graph),
+# built once when the server starts
+_script_index = None
+
+# Shared-memory screenshot segments, kept open so readers can attach.
+# _shm_lock serialises writes; _shm_seq numbers them (even when complete).
+_shm_lock = threading.Lock()
+_shm_segments = {}
+_shm_seq = 0
+_encode_pool = None
+_command_pool = None
+_tls = threading.local()  # .sample: the _Sample of the command on this worker
+
+
+class _Sample:
+    """Timings for one request, filled in as it moves through the bridge."""
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.received = time.perf_counter()
+        self.started = None
+        self.done = None
+        self.main_wait = 0.0
+        self.main_exec = 0.0
+        self._main_start = None
+
+    def main_thread(self, queued):
+        """Called on the main thread as a hop begins."""
+        self._main_start = time.perf_counter()
+        self.main_wait += self._main_start - queued
+
+    def main_thread_done(self):
+        self.main_exec += time.perf_counter() - self._main_start
+
+    def finish(self, response, size, encode_start):
+        """Called on the I/O thread once the response is encoded."""
+        now = time.perf_counter()
+        started = self.started if self.started is not None else encode_start
+        done = self.done if self.done is not None else encode_start
+        _metrics.record(self.cmd, not response.get("ok", True), {
+            "queue_ms": (started - self.received) * 1e3,
+            "main_wait_ms": self.main_wait * 1e3,
+            "main_exec_ms": self.main_exec * 1e3,
+            "deliver_ms": (encode_start - done) * 1e3,
+            "encode_ms": (now - encode_start) * 1e3,
+            "total_ms": (now - self.received) * 1e3,
+            "bytes": size,
+        })
+
+
+class _Metrics:
+    """Per-command counters and rolling windows of recent samples."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.since = time.time()
+            self.commands = {}
+
+    def record(self, cmd, error, values):
+        with self.lock:
+            if not isinstance(cmd, str) or (
+                    cmd not in self.commands and len(self.commands) >= METRICS_MAX_COMMANDS):
+                cmd = "other"  # keep junk command names from growing the table
+            entry = self.commands.get(cmd)
+            if entry is None:
+                entry = self.commands[cmd] = {
+                    "count": 0, "errors": 0,
+                    "samples": {k: collections.deque(maxlen=self.window) for k in values},
+                }
+            entry["count"] += 1
+            entry["errors"] += bool(error)
+            for k, v in values.items():
+                entry["samples"][k].append(v)
+
+    def snapshot(self):
+        """Counts plus p50/p95/p99/max of each windowed measurement."""
+        with self.lock:
+            commands = {}
+            for cmd, entry in self.commands.items():
+                stats = {"count": entry["count"], "errors": entry["errors"]}
+                for k, samples in entry["samples"].items():
+                    stats[k] = _percentiles(sorted(samples))
+                commands[cmd] = stats
+            return {"since": self.since, "window": self.window, "commands": commands}
+
+
+def _percentiles(values):
+    """p50/p95/p99/max of an already sorted list."""
+    if not values:
+        return None
+    last = len(values) - 1
+    return {
+        "p50": round(values[int(last * 0.50)], 3),
+        "p95": round(values[int(last * 0.95)], 3),
+        "p99": round(values[int(last * 0.99)], 3),
+        "max": round(values[last], 3),
+    }
+
+
+def _dump_metrics():
+    """Append one JSONL line per command to the metrics file, if configured."""
+    path = _listen_config.get("metrics_path") or os.environ.get(ENV_METRICS)
+    if not path:
+        return
+    snap = _metrics.snapshot()
+    try:
+        with open(path, "a") as f:
+            for cmd, stats in sorted(snap["commands"].items()):
+                f.write(json.dumps(dict(stats, cmd=cmd, since=snap["since"],
+                                        t=time.time(), pid=os.getpid())) + "\n")
+    except Exception as e:
+        print(f"[GamePilot] Could not write metrics: {e}")
+
+
+_metrics = _Metrics()
+
+
+class _History:
+    """Ring buffer of say lines, labels and choices, numbered by `seq`."""
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.lock = threading.Lock()
+        self.entries = collections.deque(maxlen=size)
+        self.seq = 0
+        self.spill = None  # open JSONL file, if configured
+
+    def open_spill(self, path):
+        try:
+            self.spill = open(path, "a", buffering=1)
+        except OSError as e:
+            print(f"[GamePilot] Could not open history file: {e}")
+
+    def close_spill(self):
+        with self.lock:
+            spill, self.spill = self.spill, None
+        if spill is not None:
+            spill.close()
+
+    def add(self, kind, **fields):
+        """Append an entry. Main thread only."""
+        with self.lock:
+            self.seq += 1
+            entry = dict(seq=self.seq, type=kind, t=time.time(), **fields)
+            self.entries.append(entry)
+            if self.spill is not None:
+                try:
+                    self.spill.write(json.dumps(entry) + "\n")
+                except (OSError, TypeError, ValueError) as e:
+                    print(f"[GamePilot] History spill stopped: {e}")
+                    self.spill = None
+
+    def page(self, since=0, limit=HISTORY_PAGE):
+        """Entries with seq > since, oldest first, at most limit of them."""
+        with self.lock:
+            if since > self.seq:
+                since = 0  # a cursor from before a restart
+            first = self.entries[0]["seq"] if self.entries else self.seq + 1
+            # Entries are numbered consecutively, so seq maps to an offset
+            start = max(0, since + 1 - first)
+            entries = [self.entries[i] for i in
+                       range(start, min(len(self.entries), start + limit))]
+            last = self.seq
+        return {
+            "ok": True,
+            "entries": entries,
+            "next": entries[-1]["seq"] if entries else max(since, 0),
+            "last": last,
+            "more": bool(entries) and entries[-1]["seq"] < last,
+            "dropped": max(0, first - 1 - since),
+        }
+
+
+_history = _History()
+
+
+def _history_command(data):
+    """Serve `history` from the ring buffer."""
+    since = data.get("since", 0)
+    limit = data.get("limit", HISTORY_PAGE)
+    for name, val in (("since", since), ("limit", limit)):
+        if not isinstance(val, int) or isinstance(val, bool) or val < 0:
+            return {"ok": False, "error": f"{name} must be a non-negative integer"}
+    return _history.page(since, min(limit, HISTORY_PAGE))
 
 
 def _install_hooks():
     """Install hooks into Ren'Py to track dialogue and choices."""
+    global _hooks_installed
     import renpy  # noqa — available inside Ren'Py process
+    _hooks_installed = True
 
     # Track current dialogue via say callback
     old_callback = renpy.config.say_menu_text_filter
@@ -44,6 +459,18 @@ def _install_hooks():
         if event == "begin":
             _current_speaker = kwargs.get("who", None)
             _current_dialogue = kwargs.get("what", None)
+            _publish_state()
+            _history.add("say", who=_jsonable(_current_speaker),
+                         what=_jsonable(_current_dialogue))
+            _publish({"event": "say",
+                      "who": _jsonable(_current_speaker),
+                      "what": _jsonable(_current_dialogue)})
+            run = _autorun  # other threads may clear it; read it once
+            if run is not None:
+                run.on_say(_current_speaker, _current_dialogue)
+        elif event == "end":
+            _publish({"event": "say_end",
+                      "who": _jsonable(_current_speaker)})
         for cb in original_all_character_callbacks:
             try:
                 cb(event, interact=interact, **kwargs)
@@ -55,16 +482,210 @@ def _install_hooks():
     # Track choices via menu callback
     original_choice_screen_cb = getattr(renpy.config, 'choice_screen_callback', None)
 
+    # Label entry events
+    def label_callback(name, abnormal):
+        global _last_label
+        _last_label = name
+        _publish_state()
+        _history.add("label", label=name)
+        _publish({"event": "label", "label": name, "abnormal": bool(abnormal)})
+        run = _autorun
+        if run is not None:
+            run.on_label(name)
+
+    # Menu choices, however they were made (a click, a pilot's `choose`,
+    # input during run_until): menu statements call store.menu, which is
+    # display_menu unless the game replaced it
+    global _original_menu
+    menu = getattr(renpy.store, "menu", None)
+    if menu is not None and menu is not _menu:
+        _original_menu = menu
+        renpy.store.menu = _menu
+
+    if hasattr(renpy.config, 'label_callbacks'):
+        renpy.config.label_callbacks.append(label_callback)
+    else:
+        original_label_callback = getattr(renpy.config, 'label_callback', None)
+
+        def chained_label_callback(name, abnormal):
+            if original_label_callback:
+                original_label_callback(name, abnormal)
+            label_callback(name, abnormal)
+
+        renpy.config.label_callback = chained_label_callback
+
+    # Choice screens and watched variables are checked once per interaction
+    renpy.config.interact_callbacks.append(_interact_callback)
+
     print(f"[GamePilot] Hooks installed")
 
 
+def _menu(items, *args, **kwargs):
+    """store.menu while the bridge runs: the game's menu, plus history.
+
+    Module level, so saves and checkpoints that pickle the store can
+    refer to it.
+    """
+    rv = _original_menu(items, *args, **kwargs)
+    _record_choice(items, rv)
+    return rv
+
+
+def _record_choice(items, rv):
+    """Add the menu item that returned rv to the history. Main thread only.
+
+    items are display_menu's (caption, value) pairs; the index counts only
+    choosable items, as the choice screen (and `choose`) does.
+    """
+    if rv is None:
+        return
+    choosable = [item for item in items if item[1] is not None]
+    for index, (caption, value) in enumerate(item[:2] for item in choosable):
+        if value is rv or value == rv or getattr(value, "value", None) == rv:
+            _history.add("choice", index=index, caption=str(caption))
+            return
+
+
+def _jsonable(val, depth=0):
+    """A detached JSON-safe copy of val: containers are copied recursively,
+    anything else JSON cannot carry becomes its string form.
+
+    Copying matters: the snapshot, field versions and variable events
+    compare against earlier captures, so an in-place change (a list append)
+    must not reach them through a shared reference.
+    """
+    if isinstance(val, (str, int, float, bool, type(None))):
+        return val
+    if depth < JSONABLE_DEPTH:
+        if isinstance(val, (list, tuple)):
+            return [_jsonable(v, depth + 1) for v in val]
+        if isinstance(val, dict):
+            return {str(k): _jsonable(v, depth + 1) for k, v in val.items()}
+    return str(val)
+
+
+def _choice_captions():
+    """Captions of the active choice screen, or None. Main thread only."""
+    import renpy
+    try:
+        scr = renpy.display.screen.get_screen("choice")
+    except Exception:
+        return None
+    if scr is None:
+        return None
+    items = scr.scope.get("items", [])
+    return [str(getattr(item, "caption", item)) for item in items]
+
+
+def _publish(event):
+    """Queue an event for every subscriber that wants its type."""
+    if not _subscribers:
+        return
+    event["t"] = time.time()
+    name = event.get("name") if event["event"] == "variable" else None
+    with _sub_lock:
+        # Variable events go to the subscribers watching that variable
+        targets = [c for c, types in _subscribers.items() if event["event"] in types
+                   and (name is None or name in KEY_VARS or name in _watches.get(c, ()))]
+        for client in targets:
+            _outbox.append((client, event, False, None))
+    if targets:
+        _wake()
+
+
+def _interact_callback():
+    """Refresh the state snapshot and publish choice/variable changes. Main thread only."""
+    global _last_choices, _turbo_pending
+    _publish_state()
+    if _turbo_pending is not None:
+        enabled, _turbo_pending = _turbo_pending, None
+        _set_turbo(enabled)
+    _drain_main_queue()
+    run = _autorun
+    if run is not None:
+        run.on_interact()
+    if not _subscribers:
+        return
+    import renpy
+
+    captions = _choice_captions()
+    if captions != _last_choices:
+        _last_choices = captions
+        if captions is not None:
+            _publish({"event": "choices", "choices": [
+                {"index": i, "caption": c} for i, c in enumerate(captions)
+            ]})
+
+    for name in list(_watched):
+        try:
+            val = _jsonable(getattr(renpy.store, name, None))
+        except Exception:
+            continue
+        if name in _watch_values and _watch_values[name] == val:
+            continue
+        first = name not in _watch_values
+        _watch_values[name] = val
+        if not first:
+            _publish({"event": "variable", "name": name, "value": val})
+
+
+def _string_list(data, key):
+    """data[key] as a list of strings (None if absent); ValueError otherwise."""
+    val = data.get(key)
+    if val is None:
+        return None
+    if not isinstance(val, list) or not all(isinstance(v, str) for v in val):
+        raise ValueError(f"{key} must be a list of strings")
+    return val
+
+
+def _rebuild_watched():
+    """Recompute _watched from the subscribers' watches. Call with _sub_lock held."""
+    global _watched
+    _watched = frozenset(KEY_VARS).union(*_watches.values())
+    for name in [n for n in _watch_values if n not in _watched]:
+        del _watch_values[name]
+
+
+def _subscribe(client, data):
+    """Start streaming events to a client connection."""
+    try:
+        types = _string_list(data, "events") or list(EVENT_TYPES)
+        watch = _string_list(data, "watch") or []
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}
+    unknown = [t for t in types if t not in EVENT_TYPES]
+    if unknown:
+        return {"ok": False, "error": f"Unknown event types: {unknown}"}
+    with _sub_lock:
+        mine = _watches.get(client, set()) | (set(watch) - set(KEY_VARS))
+        others = set().union(*(w for c, w in _watches.items() if c is not client))
+        if len(mine | others) > MAX_SNAPSHOT_VARS:
+            return {"ok": False,
+                    "error": f"Too many watched variables (max {MAX_SNAPSHOT_VARS})"}
+        _subscribers[client] = set(types)
+        _watches[client] = mine
+        _rebuild_watched()
+    return {"ok": True, "subscribed": sorted(types),
+            "watching": sorted(mine | set(KEY_VARS))}
+
+
+def _unsubscribe(client):
+    """Stop streaming events to a client connection and drop its watches."""
+    with _sub_lock:
+        was = _subscribers.pop(client, None) is not None
+        if _watches.pop(client, None):
+            _rebuild_watched()
+    return {"ok": True, "unsubscribed": was}
+
+
 def _get_state():
     """Gather current game state. Must be called from main thread."""
     import renpy
     result = {
         "label": None,
-        "speaker": _current_speaker,
-        "dialogue": _current_dialogue,
+        "speaker": _jsonable(_current_speaker),
+        "dialogue": _jsonable(_current_dialogue),
         "choices": [],
         "variables": {}
     }
@@ -77,55 +698,143 @@ def _get_state():
         pass
 
     # Choices from choice screen
-    try:
-        scr = renpy.display.screen.get_screen("choice")
-        if scr is not None:
-            items = scr.scope.get("items", [])
-            result["choices"] = [
-                {"index": i, "caption": str(getattr(item, "caption", item))}
-                for i, item in enumerate(items)
-            ]
-    except Exception:
-        pass
+    captions = _choice_captions()
+    if captions is not None:
+        result["choices"] = [
+            {"index": i, "caption": c} for i, c in enumerate(captions)
+        ]
 
     # Key variables
-    key_vars = [
-        "kingdom_name", "player_name", "player_title",
-        "chapter", "quest_log", "forge_lit", "gateway_raised",
-        "coronation_complete", "merith_awakened"
-    ]
-    for v in key_vars:
+    for v in KEY_VARS:
         try:
             if hasattr(renpy.store, v):
-                val = getattr(renpy.store, v)
                 # Only serialize JSON-safe types
-                if isinstance(val, (str, int, float, bool, list, dict, type(None))):
-                    result["variables"][v] = val
-                else:
-                    result["variables"][v] = str(val)
+                result["variables"][v] = _jsonable(getattr(renpy.store, v))
         except Exception:
             pass
 
     return result
 
 
+def _flatten_state(state):
+    """Flatten a _get_state() dict into versionable fields."""
+    flat = {}
+    for key, val in state.items():
+        if key == "variables":
+            for name, v in val.items():
+                flat["variables." + name] = v
+        else:
+            flat[key] = val
+    return flat
+
+
+def _unflatten_state(flat):
+    """Inverse of _flatten_state."""
+    state = {}
+    for key, val in flat.items():
+        if key.startswith("variables."):
+            state.setdefault("variables", {})[key[len("variables."):]] = val
+        else:
+            state[key] = val
+    return state
+
+
+def _publish_state():
+    """Capture the game state and swap it in as the snapshot. Main thread only."""
+    global _snapshot, _state_version
+    import renpy
+    state = _get_state()
+    with _sub_lock:
+        watched = frozenset(_watched)
+    tracked = frozenset(KEY_VARS) | watched | frozenset(_snapshot_vars)
+    store = {}
+    for name in tracked:
+        try:
+            if hasattr(renpy.store, name):
+                store[name] = _jsonable(getattr(renpy.store, name))
+        except Exception as e:
+            store[name] = f"<error: {e}>"
+    flat = _flatten_state(state)
+    with _state_lock:
+        changed = {k for k, v in flat.items()
+                   if k not in _state_fields or _state_fields[k] != v}
+        changed.update(k for k in _state_fields if k not in flat)
+        if changed:
+            _state_version += 1
+            for k in changed:
+                _field_versions[k] = _state_version
+            _state_fields.clear()
+            _state_fields.update(flat)
+        _snapshot = {"version": _state_version, "state": state,
+                     "store": store, "tracked": tracked}
+
+
+def _state_response(since_version=None):
+    """Build the `state` response from the snapshot, full or as a diff."""
+    with _state_lock:
+        version = _snapshot["version"]
+        if since_version == version:
+            return {"ok": True, "version": version, "unchanged": True}
+        if since_version is None or not 0 <= since_version < version:
+            result = {"ok": True, "version": version}
+            result.update(_snapshot["state"])
+            return result
+        # Fields that vanished since the client's version come back as None
+        diff = {k: _state_fields.get(k) for k, v in _field_versions.items() if v > since_version}
+    return {"ok": True, "version": version, "changed": _unflatten_state(diff)}
+
+
 def _get_choices():
-    """Get current choice options."""
+    """Current choice options, from the snapshot."""
+    return {"ok": True, "choices": _snapshot["state"]["choices"]}
+
+
+def _read_variables(names):
+    """Read store variables by name from the snapshot, or None if one is not tracked."""
+    snap = _snapshot
+    if any(name not in snap["tracked"] for name in names):
+        return None
+    return {"ok": True, "variables": {name: snap["store"].get(name) for name in names}}
+
+
+def _track_variables(names):
+    """Add store variables to future snapshots, up to MAX_SNAPSHOT_VARS."""
+    for name in names:
+        if name in KEY_VARS or name in _snapshot_vars:
+            continue
+        if len(_snapshot_vars) >= MAX_SNAPSHOT_VARS:
+            return False
+        _snapshot_vars.add(name)
+    return True
+
+
+def _read_store(names):
+    """Read store variables directly. Main thread only."""
     import renpy
-    try:
-        scr = renpy.display.screen.get_screen("choice")
-        if scr is not None:
-            items = scr.scope.get("items", [])
-            return {
-                "ok": True,
-                "choices": [
-                    {"index": i, "caption": str(getattr(item, "caption", item))}
-                    for i, item in enumerate(items)
-                ]
-            }
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
-    return {"ok": True, "choices": []}
+    result = {}
+    for name in names:
+        try:
+            if hasattr(renpy.store, name):
+                result[name] = _jsonable(getattr(renpy.store, name))
+            else:
+                result[name] = None
+        except Exception as e:
+            result[name] = f"<error: {e}>"
+    return {"ok": True, "variables": result}
+
+
+def _snapshot_command(data):
+    """Serve a read command from the snapshot; None if it needs the main thread."""
+    if _snapshot is None:
+        return None
+    cmd = data.get("cmd", "")
+    if cmd == "state":
+        return _state_response(data.get("since_version"))
+    if cmd == "choices":
+        return _get_choices()
+    if cmd == "variables":
+        return _read_variables(data.get("names", []))
+    return None
 
 
 def _choose(index):
@@ -142,6 +851,7 @@ def _choose(index):
         # The choice action is typically stored as item.action
         action = getattr(item, "action", None)
         if action is not None:
+            # The history entry is added by the menu hook when the menu returns
             renpy.display.behavior.run(action)
             return {"ok": True, "chosen": index}
         return {"ok": False, "error": "Choice has no action"}
@@ -177,30 +887,15 @@ def _advance():
         return {"ok": False, "error": str(e)}
 
 
-def _read_variables(names):
-    """Read store variables by name."""
-    import renpy
-    result = {}
-    for name in names:
-        try:
-            if hasattr(renpy.store, name):
-                val = getattr(renpy.store, name)
-                if isinstance(val, (str, int, float, bool, list, dict, type(None))):
-                    result[name] = val
-                else:
-                    result[name] = str(val)
-            else:
-                result[name] = None
-        except Exception as e:
-            result[name] = f"<error: {e}>"
-    return {"ok": True, "variables": result}
-
-
 def _set_variable(name, value):
-    """Set a store variable."""
+    """Set a store variable; a dotted name sets an attribute (persistent.x)."""
     import renpy
     try:
-        setattr(renpy.store, name, value)
+        target = renpy.store
+        *path, attr = name.split(".")
+        for part in path:
+            target = getattr(target, part)
+        setattr(target, attr, value)
         return {"ok": True, "name": name, "value": value}
     except Exception as e:
         return {"ok": False, "error": str(e)}
@@ -239,200 +934,1743 @@ def _screenshot(path):
         return {"ok": False, "error": str(e)}
 
 
-def _jump(label):
-    """Jump to a label."""
+def _grab_frame():
+    """Grab the raw screen surface. Main thread only; no scaling or encoding."""
     import renpy
-    try:
-        # Check label existence via the script object
-        try:
-            has = renpy.game.script.has_label(label)
-        except Exception:
-            try:
-                has = label in renpy.game.script.namemap
-            except Exception:
-                has = True  # Assume it exists and let jump fail if not
-        if has:
-            renpy.jump(label)
-            return {"ok": True, "label": label}
-        return {"ok": False, "error": f"Label '{label}' not found"}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+    return renpy.display.draw.screenshot(None)
 
 
-def _safe_main_thread(fn, *args):
-    """Try invoke_in_main_thread, fall back to direct call."""
+def _encode_frame(surf, scale=1.0, region=None, fmt="png", quality=DEFAULT_QUALITY):
+    """Crop, downscale and encode a grabbed surface. Runs off the main thread."""
+    import io
+    import pygame_sdl2 as pygame
     import renpy
+    if region is not None:
+        sw, sh = surf.get_size()
+        x, y, w, h = region
+        x, y = max(0, min(x, sw - 1)), max(0, min(y, sh - 1))
+        w, h = max(1, min(w, sw - x)), max(1, min(h, sh - y))
+        surf = surf.subsurface((x, y, w, h))
+    if scale != 1.0:
+        w, h = surf.get_size()
+        surf = pygame.transform.smoothscale(
+            surf, (max(1, int(w * scale)), max(1, int(h * scale))))
+    size = surf.get_size()
+
+    if fmt == "png":
+        sio = io.BytesIO()
+        renpy.display.module.save_png(surf, sio, 0)
+        return sio.getvalue(), size
+
+    if HAS_PIL:
+        img = _PILImage.frombytes("RGB", size, pygame.image.tostring(surf, "RGB"))
+        sio = io.BytesIO()
+        img.save(sio, format=fmt.upper(), quality=quality)
+        return sio.getvalue(), size
+
+    if fmt != "jpeg":
+        raise ValueError(f"{fmt} encoding needs Pillow")
+    # SDL_image only writes JPEG to a named file
+    fd, tmp = tempfile.mkstemp(suffix=".jpg")
+    os.close(fd)
     try:
-        return renpy.invoke_in_main_thread(fn, *args)
-    except (AttributeError, Exception):
-        # Fallback: call directly (safe for reads, risky for actions)
-        return fn(*args)
+        pygame.image.save(surf, tmp, quality)
+        with open(tmp, "rb") as f:
+            return f.read(), size
+    finally:
+        os.unlink(tmp)
 
 
-def _handle_command(data):
-    """Route a command dict to the appropriate handler."""
-    cmd = data.get("cmd", "")
+def _encoder():
+    """Worker pool that crops, scales and encodes screenshots."""
+    global _encode_pool
+    if _encode_pool is None:
+        _encode_pool = ThreadPoolExecutor(max_workers=ENCODE_WORKERS,
+                                          thread_name_prefix="GamePilotEncode")
+    return _encode_pool
 
-    if cmd == "ping":
-        return {"ok": True, "engine": "renpy", "game": "Forge the Kingdom"}
 
-    if cmd == "state":
-        try:
-            result = {"ok": True}
-            state = _safe_main_thread(_get_state)
-            result.update(state)
-            return result
-        except Exception as e:
-            return {"ok": False, "error": str(e)}
+def _write_shm(name, data):
+    """Copy data into the named shared-memory segment, resizing if needed.
 
-    if cmd == "choices":
-        try:
-            return _safe_main_thread(_get_choices)
-        except Exception as e:
-            return {"ok": False, "error": str(e)}
+    Returns (segment size, sequence number). The header's sequence number
+    is odd while the frame is written and even once it is complete, so a
+    reader that sees it change while copying knows the frame was torn.
+    """
+    global _shm_seq
+    from multiprocessing import shared_memory
+    needed = SHM_HEADER.size + len(data)
+    with _shm_lock:
+        seg = _shm_segments.get(name)
+        if seg is not None and seg.size < needed:
+            del _shm_segments[name]
+            seg.close()
+            seg.unlink()
+            seg = None
+        if seg is None:
+            try:
+                seg = shared_memory.SharedMemory(name=name, create=True, size=needed)
+            except FileExistsError:
+                # Left over from an earlier run; replace it
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                seg = shared_memory.SharedMemory(name=name, create=True, size=needed)
+            _shm_segments[name] = seg
+        _shm_seq += 2
+        SHM_HEADER.pack_into(seg.buf, 0, _shm_seq - 1, len(data))
+        seg.buf[SHM_HEADER.size:needed] = data
+        SHM_HEADER.pack_into(seg.buf, 0, _shm_seq, len(data))
+        return seg.size, _shm_seq
 
-    if cmd == "choose":
-        index = data.get("index", 0)
-        try:
-            return _safe_main_thread(_choose, index)
-        except Exception as e:
-            return {"ok": False, "error": str(e)}
 
-    if cmd == "advance":
-        try:
-            return _safe_main_thread(_advance)
-        except Exception as e:
-            return {"ok": False, "error": str(e)}
+def _deliver_frame(data, fmt, size, mode, path, shm_name, encoding="base64"):
+    """Hand encoded image bytes to the client as a file, inline or via shm."""
+    result = {"ok": True, "format": fmt, "size": len(data),
+              "width": size[0], "height": size[1]}
+    if mode == "file":
+        with open(path, "wb") as f:
+            f.write(data)
+        result["path"] = path
+    elif mode == "inline" and encoding == "binary":
+        # Raw bytes; only framed connections negotiated with binary ask for this
+        result["encoding"] = "binary"
+        result["data"] = data
+    elif mode == "inline":
+        result["encoding"] = "base64"
+        result["data"] = base64.b64encode(data).decode("ascii")
+    else:
+        result["shm"] = shm_name
+        result["segment_size"], result["seq"] = _write_shm(shm_name, data)
+        result["offset"] = SHM_HEADER.size
+    return result
 
-    if cmd == "variables":
-        names = data.get("names", [])
-        try:
-            return _safe_main_thread(_read_variables, names)
-        except Exception as e:
-            return {"ok": False, "error": str(e)}
 
-    if cmd == "set_variable":
-        name = data.get("name", "")
-        value = data.get("value", None)
-        try:
-            return _safe_main_thread(_set_variable, name, value)
-        except Exception as e:
-            return {"ok": False, "error": str(e)}
+def _screenshot_command(data, in_main_thread):
+    """Run a `screenshot` command.
 
-    if cmd == "screenshot":
-        path = data.get("path", "/tmp/game-pilot-screenshot.png")
-        try:
-            return _safe_main_thread(_screenshot, path)
-        except Exception as e:
-            return {"ok": False, "error": str(e)}
+    Only the raw grab happens on the main thread; cropping, scaling and
+    encoding go to the encoder pool unless we are already inside a
+    main-thread hop (a batch).
+    """
+    mode = data.get("mode", "file")
+    path = data.get("path", "/tmp/game-pilot-screenshot.png")
+    if mode not in ("file", "inline", "shm"):
+        return {"ok": False, "error": f"Unknown screenshot mode: {mode}"}
+    if mode == "inline" and data.get("encoding", "base64") not in ("base64", "binary"):
+        return {"ok": False, "error": f"Unknown encoding: {data['encoding']}"}
+    if mode == "file" and not any(k in data for k in ("scale", "region", "format", "quality")):
+        # Plain PNG to disk keeps the original fallbacks
+        return _screenshot(path) if in_main_thread else _safe_main_thread(_screenshot, path)
 
-    if cmd == "jump":
-        label = data.get("label", "")
-        try:
-            return _safe_main_thread(_jump, label)
-        except Exception as e:
-            return {"ok": False, "error": str(e)}
+    fmt = str(data.get("format", "png")).lower()
+    fmt = "jpeg" if fmt == "jpg" else fmt
+    if fmt not in SCREENSHOT_FORMATS:
+        return {"ok": False, "error": f"Unknown format: {fmt} (use {', '.join(SCREENSHOT_FORMATS)})"}
+    if "path" not in data:
+        # The default file takes the format's extension
+        path = os.path.splitext(path)[0] + (".jpg" if fmt == "jpeg" else "." + fmt)
+    try:
+        scale = float(data.get("scale", 1.0))
+        quality = int(data.get("quality", DEFAULT_QUALITY))
+        region = data.get("region")
+        if region is not None:
+            region = [int(v) for v in region]
+            if len(region) != 4:
+                raise ValueError("region must be [x, y, width, height]")
+    except (TypeError, ValueError) as e:
+        return {"ok": False, "error": str(e)}
+    if not 0 < scale <= 1:
+        return {"ok": False, "error": "scale must be in (0, 1]"}
+    quality = max(1, min(quality, 100))
 
-    return {"ok": False, "error": f"Unknown command: {cmd}"}
+    try:
+        surf = _grab_frame() if in_main_thread else _safe_main_thread(_grab_frame)
+        if surf is None:
+            return {"ok": False, "error": "Screenshot returned no surface"}
+        args = (surf, scale, region, fmt, quality)
+        if in_main_thread:
+            encoded, size = _encode_frame(*args)
+        else:
+            encoded, size = _encoder().submit(_encode_frame, *args).result()
+        return _deliver_frame(encoded, fmt, size, mode, path,
+                              data.get("shm", DEFAULT_SHM_NAME),
+                              data.get("encoding", "base64"))
+    except Exception as e:
+        return _error(e)
 
 
-def _handle_client(conn, addr):
-    """Handle a single client connection."""
+def _label_exists(label):
+    """Whether the game has a label: asked of Ren'Py, else the script index."""
+    import renpy
     try:
-        conn.settimeout(10.0)
-        buf = b""
-        while True:
-            chunk = conn.recv(4096)
-            if not chunk:
-                break
-            buf += chunk
-            while b"\n" in buf:
-                line, buf = buf.split(b"\n", 1)
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line.decode("utf-8"))
-                    response = _handle_command(data)
-                except json.JSONDecodeError as e:
-                    response = {"ok": False, "error": f"Invalid JSON: {e}"}
-                except Exception as e:
-                    response = {"ok": False, "error": str(e)}
-                try:
-                    conn.sendall(json.dumps(response).encode("utf-8") + b"\n")
-                except Exception:
-                    return
-            # If buffer has no newline yet but looks complete, try parsing
-            if buf and b"\n" not in buf:
-                try:
-                    data = json.loads(buf.decode("utf-8"))
-                    response = _handle_command(data)
-                    conn.sendall(json.dumps(response).encode("utf-8") + b"\n")
-                    buf = b""
-                except (json.JSONDecodeError, UnicodeDecodeError):
-                    pass  # Wait for more data
-                except Exception as e:
-                    try:
-                        conn.sendall(json.dumps({"ok": False, "error": str(e)}).encode("utf-8") + b"\n")
-                    except Exception:
-                        pass
-                    buf = b""
-    except socket.timeout:
+        return bool(renpy.game.script.has_label(label))
+    except Exception:
         pass
-    except Exception as e:
-        print(f"[GamePilot] Client error: {e}")
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+    if _script_index is not None:
+        return label in _script_index["labels"]
+    return None
 
 
-def _server_loop():
-    """Main server loop."""
-    global _running
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+def _jump(label):
+    """Jump to a label. Main thread only; the jump happens after the reply."""
+    global _pending_unwind
+    import renpy
+    exists = _label_exists(label)
+    if exists is None:
+        return {"ok": False, "error": f"Cannot check whether label '{label}' exists"}
+    if not exists:
+        return {"ok": False, "error": f"Label '{label}' not found"}
     try:
-        server.bind((HOST, PORT))
-        server.listen(5)
-        server.settimeout(1.0)
-        print(f"[GamePilot] Bridge listening on {HOST}:{PORT}")
-        while _running:
-            try:
-                conn, addr = server.accept()
-                t = threading.Thread(target=_handle_client, args=(conn, addr), daemon=True)
-                t.start()
-            except socket.timeout:
-                continue
-            except Exception as e:
-                print(f"[GamePilot] Accept error: {e}")
+        renpy.jump(label)
     except Exception as e:
-        print(f"[GamePilot] Server error: {e}")
-        traceback.print_exc()
-    finally:
+        # renpy.jump always raises; the dispatch queue re-raises it
+        _pending_unwind = e
+    return {"ok": True, "label": label}
+
+
+def _persistent_flags():
+    """The CHECKPOINT_PERSISTENT values currently set. Main thread only."""
+    import renpy
+    persistent = renpy.game.persistent
+    flags = {}
+    for name in CHECKPOINT_PERSISTENT:
         try:
-            server.close()
+            flags[name] = copy.deepcopy(getattr(persistent, name))
         except Exception:
-            pass
-        print("[GamePilot] Bridge stopped")
+            flags[name] = None
+    return flags
 
 
-def start():
-    """Start the Game Pilot bridge server."""
-    global _server_thread, _running
+def _checkpoint_save(name, store):
+    """Save the game as a named checkpoint. Main thread only."""
+    import renpy
+    if name not in _checkpoints and len(_checkpoints) >= MAX_CHECKPOINTS:
+        return {"ok": False, "error": f"Too many checkpoints (max {MAX_CHECKPOINTS}); delete some"}
+    start = time.perf_counter()
+    entry = {"store": store, "label": _snapshot["state"]["label"] if _snapshot else None,
+             "persistent": _persistent_flags(), "t": time.time()}
+    if store == "memory":
+        # What renpy.save writes as the "log" entry of a save file
+        if not hasattr(renpy.loadsave, "dump"):
+            return {"ok": False, "error": "This Ren'Py cannot checkpoint in memory; use store \"slot\""}
+        roots = renpy.game.log.freeze(None)
+        buf = io.BytesIO()
+        renpy.loadsave.dump((roots, renpy.game.log), buf)
+        entry["data"] = buf.getvalue()
+        entry["size"] = len(entry["data"])
+    else:
+        entry["slot"] = CHECKPOINT_SLOT_PREFIX + name
+        renpy.save(entry["slot"], extra_info=f"Game Pilot checkpoint {name}")
+    _checkpoints[name] = entry
+    return {"ok": True, "name": name, "store": store, "label": entry["label"],
+            "size": entry.get("size"), "ms": round((time.perf_counter() - start) * 1e3, 2)}
+
+
+def _checkpoint_load(name):
+    """Restore a checkpoint. Main thread only; the load happens after the reply."""
+    global _pending_unwind
+    import renpy
+    entry = _checkpoints.get(name)
+    if entry is None:
+        return {"ok": False, "error": f"No checkpoint named '{name}'"}
+    # The engine restarts the game's context by raising one of these
+    restarts = tuple(cls for cls in (getattr(renpy.game, "RestartContext", None),
+                                     getattr(renpy.game, "RestartTopContext", None))
+                     if cls is not None)
+    unwind = None
+    try:
+        if entry["store"] == "memory":
+            roots, log = renpy.loadsave.loads(entry["data"])
+            log.unfreeze(roots, label="_after_load")
+        else:
+            renpy.load(entry["slot"])
+    except restarts as e:
+        unwind = e
+    except Exception as e:
+        # A corrupt checkpoint or a missing slot: nothing was loaded
+        return {"ok": False, "error": f"Could not load checkpoint '{name}': {e}"}
+    # The load is going ahead, so the persistent flags can follow it
+    persistent = renpy.game.persistent
+    for flag, value in entry["persistent"].items():
+        setattr(persistent, flag, copy.deepcopy(value))
+    # The dispatch queue re-raises the restart once the reply is ready
+    _pending_unwind = unwind
+    return {"ok": True, "name": name, "label": entry["label"]}
+
+
+def _checkpoint_command(data):
+    """Save, load, list or delete named checkpoints. Main thread only."""
+    import renpy
+    action = data.get("action", "list")
+    name = data.get("name")
+    if action == "list":
+        return {"ok": True, "checkpoints": {
+            n: {k: v for k, v in e.items() if k not in ("data", "persistent")}
+            for n, e in _checkpoints.items()
+        }}
+    if not isinstance(name, str) or not name:
+        return {"ok": False, "error": "checkpoint needs a name"}
+    if action == "save":
+        store = data.get("store", "memory")
+        if store not in ("memory", "slot"):
+            return {"ok": False, "error": f"Unknown checkpoint store: {store}"}
+        return _checkpoint_save(name, store)
+    if action == "load":
+        return _checkpoint_load(name)
+    if action == "delete":
+        entry = _checkpoints.pop(name, None)
+        if entry is not None and entry["store"] == "slot":
+            try:
+                renpy.unlink_save(entry["slot"])
+            except Exception:
+                pass
+        return {"ok": True, "name": name, "deleted": entry is not None}
+    return {"ok": False, "error": f"Unknown checkpoint action: {action}"}
+
+
+def _build_script_index():
+    """Index the game's labels and script graph. Server thread, once."""
+    global _script_index
+    try:
+        import renpy
+        game_dir = renpy.config.gamedir
+    except Exception:
+        game_dir = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    try:
+        _script_index = script_graph.build_index(game_dir)
+    except Exception as e:
+        print(f"[GamePilot] Could not index the script: {e}")
+        return
+    print(f"[GamePilot] Indexed {len(_script_index['labels'])} labels in "
+          f"{(time.perf_counter() - start) * 1e3:.0f} ms")
+
+
+def _labels_command(data):
+    """Serve `labels` from the script index."""
+    if _script_index is None:
+        return {"ok": False, "error": "Script index not available"}
+    prefix = data.get("prefix", "")
+    labels = {name: info for name, info in _script_index["labels"].items()
+              if name.startswith(prefix)}
+    return {"ok": True, "count": len(labels), "labels": labels}
+
+
+def _graph_command(data):
+    """Serve `graph` from the script index, optionally around one label."""
+    if _script_index is None:
+        return {"ok": False, "error": "Script index not available"}
+    edges = _script_index["edges"]
+    label = data.get("label")
+    if label is not None:
+        if label not in _script_index["labels"]:
+            return {"ok": False, "error": f"Label '{label}' not found"}
+        edges = [e for e in edges if label in (e["from"], e["to"])]
+    return {"ok": True, "edges": edges}
+
+
+class _Cancelled(Exception):
+    """A queued main-thread call was cancelled before it ran."""
+
+
+class _MainCall:
+    """One function queued for the main thread, with a deadline.
+
+    A call goes pending -> running -> done, or pending -> cancelled when it
+    is cancelled or its deadline passes before the main thread reaches it.
+    Once running it can no longer be cancelled.
+    """
+
+    def __init__(self, fn, args, deadline, sample=None):
+        self.fn = fn
+        self.args = args
+        self.deadline = deadline
+        self.sample = sample
+        self.queued = time.perf_counter()
+        self.state = "pending"
+        self.reason = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def cancel(self, reason="cancelled"):
+        """Stop the call from running. Any thread; False if it already started."""
+        with _main_lock:
+            if self.state != "pending":
+                return False
+            self.state = "cancelled"
+            self.reason = reason
+        self.done.set()
+        return True
+
+    def run(self):
+        """Run the call unless it was cancelled or is past its deadline. Main thread only."""
+        if time.perf_counter() >= self.deadline:
+            self.cancel("timeout")
+        with _main_lock:
+            if self.state != "pending":
+                return
+            self.state = "running"
+        if self.sample is not None:
+            self.sample.main_thread(self.queued)
+        try:
+            self.result = self.fn(*self.args)
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.sample is not None:
+                self.sample.main_thread_done()
+            self.state = "done"
+            self.done.set()
+
+    def wait(self):
+        """Block until the call finishes; raise on timeout or cancellation."""
+        if not self.done.wait(max(0.0, self.deadline - time.perf_counter())):
+            self.cancel("timeout")
+        if self.state == "cancelled":
+            if self.reason == "timeout":
+                raise TimeoutError(
+                    f"Main thread did not run the command within {self.deadline - self.queued:.1f}s")
+            raise _Cancelled(f"Command {self.reason}")
+        if self.state != "done":
+            raise TimeoutError("Deadline passed while the command was running on the main thread")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _error(e):
+    """Error response for an exception, flagging timeouts and cancellations."""
+    result = {"ok": False, "error": str(e)}
+    if isinstance(e, TimeoutError):
+        result["timeout"] = True
+    elif isinstance(e, _Cancelled):
+        result["cancelled"] = True
+    return result
+
+
+def _drain_main_queue():
+    """Run every queued main-thread call. Main thread only.
+
+    A `jump` or checkpoint load cannot raise from inside its call without
+    losing the reply, so it parks the engine's exception and it is re-raised
+    here, after the call is done; calls still queued behind it are put back.
+    """
+    global _main_kicked, _pending_unwind
+    with _main_lock:
+        calls = list(_main_queue)
+        _main_queue.clear()
+        _main_kicked = False
+    for i, call in enumerate(calls):
+        call.run()
+        if _pending_unwind is not None:
+            unwind, _pending_unwind = _pending_unwind, None
+            if i + 1 < len(calls):
+                with _main_lock:
+                    _main_queue.extendleft(reversed(calls[i + 1:]))
+                _kick_main()
+            raise unwind
+
+
+def _request_deadline(data):
+    """Deadline (perf_counter) for a request's `deadline_ms`, or None."""
+    ms = data.get("deadline_ms")
+    if ms is None:
+        return None
+    if not isinstance(ms, (int, float)) or isinstance(ms, bool) or ms <= 0:
+        raise ValueError("deadline_ms must be a positive number")
+    sample = getattr(_tls, "sample", None)
+    start = sample.received if sample is not None else time.perf_counter()
+    return start + min(ms / 1000.0, MAX_DEADLINE)
+
+
+def _track(key, job):
+    """Register a cancellable job under (client, id); no-op without a key.
+
+    Untagged requests use (client, None): `cancel` cannot reach them, but a
+    disconnect still does.
+    """
+    if key is not None:
+        with _main_lock:
+            _inflight[key] = job
+
+
+def _untrack(key, job):
+    if key is not None:
+        with _main_lock:
+            if _inflight.get(key) is job:
+                del _inflight[key]
+
+
+def _cancel(client, req_id, reason="cancelled"):
+    """Cancel a connection's request by id, queued or on the main thread."""
+    cancelled = False
+    with client.lock:
+        for i, (fn, queued_id, sample, switch) in enumerate(client.serial):
+            if queued_id == req_id:
+                error = {"ok": False, "error": f"Command {reason}", "cancelled": True}
+                client.serial[i] = (lambda error=error: error, queued_id, sample, switch)
+                cancelled = True
+    with _main_lock:
+        job = _inflight.get((client, req_id))
+    if job is not None and job.cancel(reason):
+        cancelled = True
+    return cancelled
+
+
+def _cancel_client(client):
+    """Cancel everything a closed connection still has in flight."""
+    with _main_lock:
+        jobs = [job for (c, _), job in _inflight.items() if c is client]
+    for job in jobs:
+        job.cancel("disconnected")
+
+
+def _safe_main_thread(fn, *args):
+    """Run fn in the main thread and wait for its result.
+
+    The call goes on the dispatch queue with the request's deadline (or
+    MAIN_THREAD_TIMEOUT); missing it raises TimeoutError and a `cancel`
+    raises _Cancelled. Nothing is ever run directly on the calling thread.
+    """
+    deadline = getattr(_tls, "deadline", None)
+    if deadline is None:
+        deadline = time.perf_counter() + MAIN_THREAD_TIMEOUT
+    call = _MainCall(fn, args, deadline, getattr(_tls, "sample", None))
+    key = getattr(_tls, "key", None)
+    _track(key, call)
+    try:
+        _main_submit(call)
+        return call.wait()
+    finally:
+        _untrack(key, call)
+
+
+def _main_submit(call):
+    """Queue a call for the main thread and make sure it gets drained."""
+    with _main_lock:
+        _main_queue.append(call)
+    _kick_main()
+
+
+def _kick_main():
+    """Ask the main thread to drain the queue, unless already asked."""
+    global _main_kicked
+    with _main_lock:
+        if _main_kicked:
+            return
+        _main_kicked = True
+    try:
+        import renpy
+        renpy.invoke_in_main_thread(_drain_main_queue)
+    except Exception:
+        # No event loop to kick yet; the next interaction drains the queue
+        with _main_lock:
+            _main_kicked = False
+
+
+def turbo_time(seconds):
+    """Delay for a screen `timer`: TURBO_DELAY while turbo mode is on."""
+    return TURBO_DELAY if _turbo else seconds
+
+
+def _install_turbo_wrappers():
+    """Wrap renpy.pause and music/sound playback to honour turbo mode."""
+    global _turbo_wrapped
+    import renpy
+    if _turbo_wrapped:
+        return
+    _turbo_wrapped = True
+
+    original_pause = renpy.exports.pause
+
+    def pause(delay=None, *args, **kwargs):
+        if _turbo and delay is not None:
+            delay = min(delay, TURBO_DELAY)
+        return original_pause(delay, *args, **kwargs)
+
+    renpy.exports.pause = pause
+    store_renpy = getattr(renpy.store, "renpy", None)
+    if store_renpy is not None and getattr(store_renpy, "pause", None) is original_pause:
+        store_renpy.pause = pause
+
+    # renpy.music is renpy.audio.music, and renpy.sound and the Play action
+    # go through it too, so wrapping play/queue skips all audio decoding
+    music = renpy.audio.music
+    for name in ("play", "queue"):
+        original = getattr(music, name)
+
+        def wrapper(*args, _original=original, **kwargs):
+            if _turbo:
+                return None
+            return _original(*args, **kwargs)
+
+        setattr(music, name, wrapper)
+
+
+def _set_turbo(enabled):
+    """Switch turbo (throughput) mode on or off. Main thread only."""
+    global _turbo
+    import renpy
+    prefs = renpy.game.preferences
+    if enabled and not _turbo:
+        _install_turbo_wrappers()
+        _turbo_saved.clear()
+        for name in ("transitions", "text_cps"):
+            _turbo_saved[name] = getattr(prefs, name)
+        prefs.transitions = 0  # none
+        prefs.text_cps = 0  # instant text
+        for channel in ("music", "sound"):
+            try:
+                renpy.audio.music.stop(channel=channel)
+            except Exception:
+                pass
+        _turbo = True
+    elif not enabled and _turbo:
+        for name, value in _turbo_saved.items():
+            setattr(prefs, name, value)
+        _turbo = False
+    return {"ok": True, "turbo": _turbo}
+
+
+def _queue_dismiss():
+    """Dismiss the current line as a click would. Main thread only."""
+    import renpy
+    try:
+        renpy.queue_event("dismiss")
+    except Exception:
+        _advance()
+
+
+class _AutoRun:
+    """State of one `run_until`, driven by the hooks on the main thread.
+
+    Each new interaction is checked against the stop conditions; if none
+    holds, the line is dismissed once. The waiting worker re-dismisses when
+    nothing has happened for AUTORUN_NUDGE seconds (click-to-continue
+    pauses and screens that restart their interaction).
+
+    Only the main thread finishes a run (clearing _autorun and closing the
+    profile). Other threads ask for it with stop(), which the main thread
+    honours at its next hook or queued call.
+    """
+
+    def __init__(self, stop_at_choice, labels, variable, max_lines, profile=False):
+        self.stop_at_choice = stop_at_choice
+        self.labels = labels  # stop on entering any of these
+        self.variable = variable
+        self.max_lines = max_lines
+        self.transcript = []
+        self.lines = 0
+        self.progress = 0  # bumped by every say/label, read by the nudger
+        self.dismissed_at = None  # progress value we last dismissed for
+        self.reason = None
+        self.stopping = None  # reason a stop was asked for from another thread
+        self.stopped_at = None  # label that stopped the run
+        self.done = threading.Event()
+        # Per-label profile: wall time between label entries, interactions,
+        # and main-thread time from each dismiss to the next interaction
+        self.profile = {} if profile else None
+        self.current = _last_label
+        self.label_since = time.perf_counter()
+        self.busy_since = None
+
+    def _stats(self, label):
+        return self.profile.setdefault(label, {
+            "visits": 0, "interactions": 0, "wall_ms": 0.0, "main_ms": 0.0})
+
+    def _account(self, now, busy_until_now):
+        """Charge time up to now to the current label."""
+        stats = self._stats(self.current)
+        stats["wall_ms"] += (now - self.label_since) * 1e3
+        self.label_since = now
+        if busy_until_now and self.busy_since is not None:
+            stats["main_ms"] += (now - self.busy_since) * 1e3
+            self.busy_since = now
+
+    def profile_result(self):
+        """The profile with times rounded, or None."""
+        if self.profile is None:
+            return None
+        return {label: dict(stats, wall_ms=round(stats["wall_ms"], 2),
+                            main_ms=round(stats["main_ms"], 2))
+                for label, stats in self.profile.items()}
+
+    def finish(self, reason):
+        """End the run. Main thread only."""
+        global _autorun
+        if self.reason is None:
+            self.reason = reason
+            if self.profile is not None:
+                self._account(time.perf_counter(), False)
+        if _autorun is self:
+            _autorun = None
+        self.done.set()
+
+    def stop(self, reason):
+        """Ask the main thread to end the run. Any thread; never blocks."""
+        if self.done.is_set():
+            return False
+        if self.stopping is None:
+            self.stopping = reason
+        _main_submit(_MainCall(self.settle, (), time.perf_counter() + MAIN_THREAD_TIMEOUT))
+        return True
+
+    def settle(self):
+        """Honour a stop() request. Main thread only; True if the run ended."""
+        if self.stopping is not None:
+            self.finish(self.stopping)
+            return True
+        return self.done.is_set()
+
+    def abandon(self):
+        """Give up on a main thread that never settled the run. The main
+        thread still finishes it at its next hook."""
+        if self.reason is None:
+            self.reason = self.stopping
+        self.done.set()
+
+    def cancel(self, reason="cancelled"):
+        """Stop the run early. Any thread; False if it already finished."""
+        return self.stop(reason)
+
+    def on_say(self, who, what):
+        if self.settle():
+            return
+        self.lines += 1
+        self.progress += 1
+        self.transcript.append({"who": _jsonable(who), "what": _jsonable(what)})
+
+    def on_label(self, name):
+        if self.settle():
+            return
+        self.progress += 1
+        self.transcript.append({"label": name})
+        if self.profile is not None:
+            self._account(time.perf_counter(), True)
+            self.current = name
+            self._stats(name)["visits"] += 1
+        if self.labels and name in self.labels:
+            self.stopped_at = name
+            self.finish("label")
+
+    def check(self):
+        """Return the reason to stop now, or None. Main thread only."""
+        import renpy
+        if self.stop_at_choice and _choice_captions() is not None:
+            return "choice"
+        if self.variable is not None:
+            name, value = self.variable
+            if getattr(renpy.store, name, None) == value:
+                return "variable"
+        if self.max_lines is not None and self.lines >= self.max_lines:
+            return "max_lines"
+        return None
+
+    def on_interact(self):
+        if self.settle():
+            return
+        if self.profile is not None:
+            self._stats(self.current)["interactions"] += 1
+            if self.busy_since is not None:
+                self._account(time.perf_counter(), True)
+                self.busy_since = None
+        reason = self.check()
+        if reason is not None:
+            self.finish(reason)
+        elif self.dismissed_at != self.progress:
+            self.dismiss()
+
+    def dismiss(self):
+        self.dismissed_at = self.progress
+        if self.profile is not None and self.busy_since is None:
+            self.busy_since = time.perf_counter()
+        _queue_dismiss()
+
+    def nudge(self):
+        """Dismiss again when stuck on the same line. Main thread only."""
+        if not self.settle():
+            self.dismiss()
+
+
+def _autorun_begin(run):
+    """Install a run_until on the main thread, unless it is already done."""
+    global _autorun
+    if _autorun is not None:
+        return {"ok": False, "error": "run_until already in progress"}
+    _publish_state()
+    reason = run.check()
+    if reason is not None:
+        run.finish(reason)
+    else:
+        _autorun = run
+        run.on_interact()
+    return None
+
+
+def _run_until(data):
+    """Advance inside the game until a stop condition holds."""
+    variable = data.get("variable")
+    if variable is not None:
+        if not isinstance(variable, dict) or "name" not in variable:
+            return {"ok": False, "error": "variable must be {\"name\": ..., \"value\": ...}"}
+        variable = (variable["name"], variable.get("value"))
+    try:
+        max_lines = data.get("max_lines", AUTORUN_MAX_LINES)
+        max_lines = None if max_lines is None else int(max_lines)
+        timeout = min(float(data.get("timeout", AUTORUN_TIMEOUT)), AUTORUN_MAX_TIMEOUT)
+    except (TypeError, ValueError) as e:
+        return {"ok": False, "error": str(e)}
+    if getattr(_tls, "deadline", None) is not None:
+        # deadline_ms bounds the whole run, not just the first hop
+        timeout = min(timeout, _tls.deadline - time.perf_counter())
+    labels = data.get("label")
+    if labels is not None:
+        labels = {labels} if isinstance(labels, str) else set(labels)
+    run = _AutoRun(bool(data.get("choice", True)), labels, variable, max_lines,
+                   bool(data.get("profile", False)))
+
+    error = _safe_main_thread(_autorun_begin, run)
+    if error:
+        return error
+    key = getattr(_tls, "key", None)
+    _track(key, run)
+    if key is not None and key[0].sock not in _clients:
+        # The client left while the run was being installed
+        run.cancel("disconnected")
+    try:
+        _autorun_wait(run, timeout)
+    finally:
+        _untrack(key, run)
+
+    result = {
+        "ok": True,
+        "reason": run.reason,
+        "lines": run.lines,
+        "transcript": run.transcript,
+    }
+    if run.reason == "choice":
+        result["choices"] = _get_choices()["choices"]
+    elif run.reason == "label":
+        result["label"] = run.stopped_at
+    if run.profile is not None:
+        result["profile"] = run.profile_result()
+    return result
+
+
+def _autorun_wait(run, timeout):
+    """Wait for a run_until to finish, nudging it when it stalls."""
+    deadline = time.monotonic() + timeout
+    seen = run.progress
+    stalled_since = time.monotonic()
+    while not run.done.wait(AUTORUN_POLL):
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        if run.progress != seen:
+            seen, stalled_since = run.progress, now
+        elif now - stalled_since >= AUTORUN_NUDGE:
+            stalled_since = now
+            try:
+                _safe_main_thread(run.nudge)
+            except Exception:
+                pass
+    if not run.done.is_set():
+        # The main thread ends the run (and its profile) at its next hook
+        run.stop("timeout")
+        if not run.done.wait(MAIN_THREAD_TIMEOUT):
+            run.abandon()
+
+
+def _run_command(data):
+    """Execute one game command body. Main thread only."""
+    cmd = data.get("cmd", "")
+    if cmd in MUTATING_COMMANDS:
+        try:
+            return _run_mutation(cmd, data)
+        finally:
+            _publish_state()
+
+    if cmd == "ping":
+        return {"ok": True, "engine": "renpy", "game": "Forge the Kingdom"}
+
+    if cmd in SNAPSHOT_COMMANDS:
+        names = data.get("names", []) if cmd == "variables" else ()
+        if not _track_variables(names):
+            return _read_store(names)
+        _publish_state()
+        return _snapshot_command(data)
+
+    if cmd == "screenshot":
+        return _screenshot_command(data, in_main_thread=True)
+
+    if cmd == "history":
+        return _history_command(data)
+
+    if cmd == "checkpoint":
+        return _checkpoint_command(data)
+
+    if cmd == "turbo":
+        if "enabled" not in data:
+            return {"ok": True, "turbo": _turbo}
+        return _set_turbo(bool(data["enabled"]))
+
+    return {"ok": False, "error": f"Unknown command: {cmd}"}
+
+
+def _run_mutation(cmd, data):
+    """Execute one of MUTATING_COMMANDS. Main thread only."""
+    if cmd == "choose":
+        return _choose(data.get("index", 0))
+    if cmd == "advance":
+        return _advance()
+    if cmd == "set_variable":
+        return _set_variable(data.get("name", ""), data.get("value", None))
+    return _jump(data.get("label", ""))
+
+
+def _run_batch(commands, stop_on_error):
+    """Execute sub-commands in order within one main-thread hop."""
+    results = []
+    for sub in commands:
+        cmd = sub.get("cmd", "") if isinstance(sub, dict) else None
+        if cmd not in BATCH_COMMANDS:
+            result = {"ok": False, "error": f"Command not allowed in batch: {cmd}"}
+        elif sub.get("encoding") == "binary":
+            result = {"ok": False, "error": "binary encoding is not available inside batch"}
+        else:
+            try:
+                result = _run_command(sub)
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+        results.append(result)
+        if stop_on_error and not result.get("ok"):
+            break
+    return {
+        "ok": all(r.get("ok") for r in results),
+        "results": results,
+        "completed": len(results),
+    }
+
+
+def _handle_command(data):
+    """Route a command dict to the appropriate handler."""
+    cmd = data.get("cmd", "")
+
+    if cmd == "ping":
+        return _run_command(data)
+
+    if cmd == "history":
+        return _history_command(data)
+
+    if cmd == "labels":
+        return _labels_command(data)
+
+    if cmd == "graph":
+        return _graph_command(data)
+
+    if cmd == "metrics":
+        snap = _metrics.snapshot()
+        if data.get("reset"):
+            _metrics.reset()
+        return dict(snap, ok=True)
+
+    if cmd == "run_until":
+        try:
+            return _run_until(data)
+        except Exception as e:
+            return _error(e)
+
+    if cmd == "batch":
+        commands = data.get("commands", [])
+        if not isinstance(commands, list):
+            return {"ok": False, "error": "batch needs a list of commands"}
+        try:
+            return _safe_main_thread(_run_batch, commands,
+                                     bool(data.get("stop_on_error", False)))
+        except Exception as e:
+            return _error(e)
+
+    if cmd == "state" and "since_version" in data:
+        since = data["since_version"]
+        if not isinstance(since, int) or isinstance(since, bool):
+            return {"ok": False, "error": "since_version must be an integer"}
+
+    if cmd == "variables" and not isinstance(data.get("names", []), list):
+        return {"ok": False, "error": "names must be a list"}
+
+    if cmd in SNAPSHOT_COMMANDS:
+        result = _snapshot_command(data)
+        if result is not None:
+            return result
+
+    if cmd == "screenshot":
+        try:
+            return _screenshot_command(data, in_main_thread=False)
+        except Exception as e:
+            return _error(e)
+
+    if cmd in BATCH_COMMANDS:
+        try:
+            return _safe_main_thread(_run_command, data)
+        except Exception as e:
+            return _error(e)
+
+    return {"ok": False, "error": f"Unknown command: {cmd}"}
+
+
+class _LineFramer:
+    """Incremental newline framer; linear in the number of bytes fed.
+
+    Bytes accumulate in one bytearray. Each byte is scanned for a newline
+    once, consumed messages are trimmed off the front once per batch, and
+    an unterminated message is never parsed until its newline arrives.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = MAX_MESSAGE_SIZE if max_size is None else max_size
+        self.buf = bytearray()
+        self.pos = 0  # start of the first unconsumed message
+        self.scan = 0  # no newline before this offset
+        self.discarding = False  # skipping the rest of an oversized message
+
+    def feed(self, chunk):
+        """Append received bytes."""
+        self.buf += chunk
+
+    def messages(self):
+        """Yield each complete line (without newline); None if oversized."""
+        buf = self.buf
+        while True:
+            nl = buf.find(b"\n", self.scan)
+            if nl < 0:
+                self.scan = len(buf)
+                if not self.discarding and self.scan - self.pos > self.max_size:
+                    self.discarding = True
+                    yield None
+                if self.discarding:
+                    self.pos = self.scan
+                break
+            start, skip = self.pos, self.discarding
+            self.pos = self.scan = nl + 1
+            self.discarding = False
+            if skip:
+                continue
+            if nl - start > self.max_size:
+                yield None
+                continue
+            yield bytes(buf[start:nl])
+        del buf[:self.pos]
+        self.scan -= self.pos
+        self.pos = 0
+
+    def rest(self):
+        """Take every buffered byte not yet returned as a message."""
+        data = bytes(self.buf[self.pos:])
+        self.buf.clear()
+        self.pos = self.scan = 0
+        self.discarding = False
+        return data
+
+
+class _Client:
+    """One pilot connection multiplexed on the bridge I/O thread."""
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.framer = _LineFramer()
+        self.rbuf = bytearray()  # framed mode only
+        self.wbuf = bytearray()
+        self.last_active = time.monotonic()  # last request in or response out
+        self.pending = 0  # requests not yet answered; I/O thread only
+        self.closing = False  # close as soon as wbuf has drained
+        # Negotiated by `hello`; line-delimited JSON until then
+        self.framed_in = False  # parse input as frames
+        self.framed = False  # write output as frames
+        self.compress = False
+        self.binary = False
+        # Untagged commands and all writes run one at a time, in order
+        self.lock = threading.Lock()
+        self.serial = collections.deque()
+        self.serial_busy = False
+
+
+def _frame(kind, payload, compress=False):
+    """Build one length-prefixed frame, zlib-compressing large payloads."""
+    if compress and len(payload) >= COMPRESS_THRESHOLD:
+        packed = zlib.compress(payload, COMPRESS_LEVEL)
+        if len(packed) < len(payload):
+            return FRAME_HEADER.pack(kind | FLAG_ZLIB, len(packed)) + packed
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+def _encode(client, response):
+    """Serialise a response for a client's current protocol.
+
+    On framed connections a bytes "data" field travels as a separate raw
+    binary frame right after the JSON frame. Line connections get it
+    base64-encoded instead: a binary screenshot can finish before the
+    `hello` reply that switches the output to frames has gone out.
+    Raises TypeError or ValueError if the response is not serialisable.
+    """
+    blob = response.get("data")
+    if not isinstance(blob, (bytes, bytearray)):
+        blob = None
+    if not client.framed:
+        if blob is not None:
+            response = dict(response, encoding="base64",
+                            data=base64.b64encode(blob).decode("ascii"))
+        return response, json.dumps(response).encode("utf-8") + b"\n"
+    if blob is not None:
+        response = dict(response, data=None, binary=len(blob))
+    out = _frame(FRAME_JSON, json.dumps(response).encode("utf-8"), client.compress)
+    if blob is not None:
+        out += _frame(FRAME_BINARY, blob)
+    return response, out
+
+
+def _send(client, response, sample=None):
+    """Queue a JSON response for a client and try to flush it.
+
+    A response that cannot be serialised is answered with an error in its
+    place; if even that fails, the connection is closed. Either way the
+    I/O loop keeps serving everyone else.
+    """
+    encode_start = time.perf_counter()
+    try:
+        response, out = _encode(client, response)
+    except (TypeError, ValueError, OverflowError) as e:
+        print(f"[GamePilot] Unserialisable response for {client.addr}: {e}")
+        error = {"ok": False, "error": f"Response could not be encoded: {e}"}
+        if "id" in response:
+            error["id"] = response["id"]
+        try:
+            response, out = _encode(client, error)
+        except (TypeError, ValueError):
+            _close(client)
+            return
+    client.wbuf += out
+    if sample is not None:
+        sample.finish(response, len(out), encode_start)
+    _flush(client)
+
+
+def _flush(client):
+    """Write as much of the pending output as the socket accepts."""
+    try:
+        while client.wbuf:
+            sent = client.sock.send(client.wbuf)
+            del client.wbuf[:sent]
+    except (BlockingIOError, InterruptedError):
+        pass
+    except Exception:
+        _close(client)
+        return
+    if not client.wbuf and client.closing:
+        _close(client)
+        return
+    events = selectors.EVENT_READ
+    if client.wbuf:
+        events |= selectors.EVENT_WRITE
+    try:
+        _selector.modify(client.sock, events, client)
+    except (KeyError, ValueError):
+        pass
+
+
+def _close(client):
+    """Unregister and close a client connection."""
+    _clients.pop(client.sock, None)
+    if client in _subscribers:
+        _unsubscribe(client)
+    _cancel_client(client)
+    try:
+        _selector.unregister(client.sock)
+    except (KeyError, ValueError):
+        pass
+    try:
+        client.sock.close()
+    except Exception:
+        pass
+
+
+def _hello(client, data):
+    """Negotiate the wire protocol for a connection. I/O thread only.
+
+    Input switches to frames at once; output switches when the reply is
+    sent (see _drain_outbox), so earlier responses still go out as lines.
+    """
+    protocol = data.get("protocol", "line")
+    if protocol not in ("line", "framed"):
+        return {"ok": False, "error": f"Unknown protocol: {protocol}"}
+    if client.framed_in and protocol == "line":
+        return {"ok": False, "error": "Cannot leave framed mode"}
+    result = {
+        "ok": True,
+        "protocols": ["line", "framed"],
+        "compressions": ["zlib"],
+        "protocol": protocol,
+    }
+    if protocol == "framed":
+        client.compress = "zlib" in data.get("compression", [])
+        client.binary = bool(data.get("binary", False))
+        result.update({
+            "compression": "zlib" if client.compress else None,
+            "binary": client.binary,
+            "max_frame": MAX_FRAME_SIZE,
+        })
+        client.framed_in = True
+    return result
+
+
+def _connection_command(client, data):
+    """Handle commands bound to a connection, else defer to _handle_command."""
+    cmd = data.get("cmd", "")
+    if cmd == "subscribe":
+        return _subscribe(client, data)
+    if cmd == "unsubscribe":
+        return _unsubscribe(client)
+    if cmd == "screenshot" and data.get("mode") == "inline":
+        if client.binary:
+            data.setdefault("encoding", "binary")
+        elif data.get("encoding") == "binary":
+            return {"ok": False, "error": "binary encoding needs a framed connection with binary enabled"}
+    try:
+        _tls.deadline = _request_deadline(data)
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}
+    _tls.key = (client, data.get("id"))
+    try:
+        return _handle_command(data)
+    finally:
+        _tls.deadline = _tls.key = None
+
+
+def _dispatch(client, payload):
+    """Decode one request and schedule it. I/O thread only.
+
+    Tagged reads run concurrently on the command pool. Everything else goes
+    through the connection's serial queue so that untagged responses keep
+    their order and writes never overtake each other.
+    """
+    try:
+        data = json.loads(payload.decode("utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError("Request must be a JSON object")
+    except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as e:
+        error = {"ok": False, "error": f"Invalid JSON: {e}"}
+        _enqueue(client, lambda: error)
+        return
+    cmd = data.get("cmd", "")
+    req_id = data.get("id")
+    sample = _Sample(cmd)
+    if cmd == "hello":
+        response = _hello(client, data)
+        _enqueue(client, lambda: response, req_id, sample,
+                 switch=response.get("ok") and response.get("protocol") == "framed")
+    elif cmd == "cancel":
+        # Answered at once, ahead of anything still queued on the connection
+        client.pending += 1
+        target = data.get("target")
+        if target is None:
+            response = {"ok": False, "error": "cancel needs a target request id"}
+        else:
+            response = {"ok": True, "target": target, "cancelled": _cancel(client, target)}
+        _post(client, _tagged(response, req_id), sample=sample)
+    elif req_id is not None and cmd in CONCURRENT_COMMANDS:
+        client.pending += 1
+        _commands().submit(_run_request, client, data, req_id, sample)
+    else:
+        _enqueue(client, lambda: _connection_command(client, data), req_id, sample)
+
+
+def _commands():
+    """Worker pool that executes bridge commands off the I/O thread."""
+    global _command_pool
+    if _command_pool is None:
+        _command_pool = ThreadPoolExecutor(max_workers=COMMAND_WORKERS,
+                                           thread_name_prefix="GamePilotCmd")
+    return _command_pool
+
+
+def _tagged(response, req_id):
+    """Echo the request id into a response."""
+    if req_id is not None:
+        response = dict(response, id=req_id)
+    return response
+
+
+def _execute(fn, sample):
+    """Run a command on a worker thread, timing it into sample."""
+    if sample is not None:
+        sample.started = time.perf_counter()
+    _tls.sample = sample
+    try:
+        return fn()
+    except Exception as e:
+        return _error(e)
+    finally:
+        _tls.sample = None
+        if sample is not None:
+            sample.done = time.perf_counter()
+
+
+def _run_request(client, data, req_id, sample=None):
+    """Run one tagged read on the command pool and post its response."""
+    response = _execute(lambda: _connection_command(client, data), sample)
+    _post(client, _tagged(response, req_id), sample=sample)
+
+
+def _enqueue(client, fn, req_id=None, sample=None, switch=False):
+    """Append work to a connection's serial queue and make sure it drains.
+
+    I/O thread only.
+    """
+    client.pending += 1
+    with client.lock:
+        client.serial.append((fn, req_id, sample, switch))
+        if client.serial_busy:
+            return
+        client.serial_busy = True
+    _commands().submit(_drain_serial, client)
+
+
+def _drain_serial(client):
+    """Run a connection's queued commands in order on the command pool."""
+    while True:
+        with client.lock:
+            if not client.serial:
+                client.serial_busy = False
+                return
+            fn, req_id, sample, switch = client.serial.popleft()
+        response = _execute(fn, sample)
+        _post(client, _tagged(response, req_id), switch, sample)
+
+
+def _post(client, response, switch=False, sample=None):
+    """Hand a response to the I/O thread. Any thread."""
+    with _sub_lock:
+        _outbox.append((client, response, switch, sample))
+    _wake()
+
+
+def _drain_outbox():
+    """Deliver queued responses and events. I/O thread only."""
+    with _sub_lock:
+        pending = _outbox[:]
+        del _outbox[:]
+    for client, payload, switch, sample in pending:
+        if client.sock not in _clients:
+            continue
+        if "event" not in payload:
+            client.pending -= 1
+            client.last_active = time.monotonic()
+        elif len(client.wbuf) > MAX_PENDING_OUTPUT:
+            print(f"[GamePilot] Dropping slow subscriber {client.addr}")
+            _close(client)
+            continue
+        try:
+            _send(client, payload, sample)
+        except Exception as e:
+            # One broken connection must not take the I/O loop down
+            print(f"[GamePilot] Send error for {client.addr}: {e}")
+            _close(client)
+            continue
+        if switch:
+            # The hello reply itself went out in line mode
+            client.framed = True
+
+
+def _reply_error(client, message):
+    """Answer an unparseable request in order with the other responses."""
+    error = {"ok": False, "error": message}
+    _enqueue(client, lambda: error)
+
+
+def _read_frames(client):
+    """Consume complete frames from a framed connection's read buffer."""
+    buf = client.rbuf
+    pos = 0
+    while len(buf) - pos >= FRAME_HEADER.size and client.sock in _clients:
+        kind, length = FRAME_HEADER.unpack_from(buf, pos)
+        if length > MAX_FRAME_SIZE:
+            _send(client, {"ok": False, "error": f"Frame too large ({length} bytes)"})
+            client.closing = True
+            _flush(client)
+            pos = len(buf)
+            break
+        start = pos + FRAME_HEADER.size
+        end = start + length
+        if len(buf) < end:
+            break
+        payload = bytes(buf[start:end])
+        pos = end
+        if kind & FLAG_ZLIB:
+            inflater = zlib.decompressobj()
+            try:
+                payload = inflater.decompress(payload, MAX_FRAME_SIZE)
+            except zlib.error as e:
+                _reply_error(client, f"Bad compressed frame: {e}")
+                continue
+            if inflater.unconsumed_tail:
+                _reply_error(client, "Decompressed frame too large")
+                continue
+        if kind & ~FLAG_ZLIB != FRAME_JSON:
+            _reply_error(client, f"Unsupported frame type {kind & ~FLAG_ZLIB}")
+            continue
+        _dispatch(client, payload)
+    del buf[:pos]
+
+
+def _handle_client(client, chunk):
+    """Handle bytes received from a client connection."""
+    if client.framed_in:
+        client.rbuf += chunk
+        _read_frames(client)
+        return
+    client.framer.feed(chunk)
+    for line in client.framer.messages():
+        if line is None:
+            _reply_error(client, f"Message too large (max {client.framer.max_size} bytes)")
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        _dispatch(client, line)
+        if client.framed_in:
+            # Anything pipelined after the hello is already framed
+            client.rbuf += client.framer.rest()
+            _read_frames(client)
+            return
+
+
+def _accept(server):
+    """Accept every pending connection, enforcing MAX_CONNECTIONS."""
+    while True:
+        try:
+            conn, addr = server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception as e:
+            print(f"[GamePilot] Accept error: {e}")
+            return
+        if len(_clients) >= MAX_CONNECTIONS:
+            try:
+                conn.send(json.dumps({
+                    "ok": False,
+                    "error": f"Too many connections (max {MAX_CONNECTIONS})",
+                }).encode("utf-8") + b"\n")
+            except Exception:
+                pass
+            conn.close()
+            continue
+        conn.setblocking(False)
+        if conn.family != _AF_UNIX:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(conn, addr)
+        _clients[conn] = client
+        _selector.register(conn, selectors.EVENT_READ, client)
+
+
+def _service(client, mask):
+    """Handle a readiness event for one client."""
+    if mask & selectors.EVENT_READ:
+        try:
+            chunk = client.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            chunk = None
+        except Exception:
+            chunk = b""
+        if chunk == b"":
+            _close(client)
+            return
+        if chunk:
+            client.last_active = time.monotonic()
+            try:
+                _handle_client(client, chunk)
+            except Exception as e:
+                print(f"[GamePilot] Client error: {e}")
+                _close(client)
+                return
+    if mask & selectors.EVENT_WRITE and client.sock in _clients:
+        _flush(client)
+
+
+def _sweep_idle():
+    """Drop clients silent for CLIENT_IDLE_TIMEOUT seconds.
+
+    Subscribers and clients still waiting on a request (a long `run_until`,
+    a `deadline_ms` wait) are kept.
+    """
+    cutoff = time.monotonic() - CLIENT_IDLE_TIMEOUT
+    for client in list(_clients.values()):
+        if (client.last_active < cutoff and not client.pending
+                and client not in _subscribers):
+            _close(client)
+
+
+def _parse_ports(spec):
+    """Turn "47201", "0" or "47201-47210" into a list of ports to try."""
+    spec = str(spec).strip()
+    if "-" in spec:
+        first, last = (int(p) for p in spec.split("-", 1))
+        if first > last:
+            raise ValueError(f"Bad port range: {spec}")
+        return list(range(first, last + 1))
+    return [int(spec)]
+
+
+def _open_listener():
+    """Bind the listening socket from start() arguments, env vars or defaults."""
+    socket_path = _listen_config.get("socket_path") or os.environ.get(ENV_SOCKET)
+    if socket_path:
+        if _AF_UNIX is None:
+            raise OSError("Unix sockets are not supported on this platform")
+        if os.path.exists(socket_path):
+            # Only clear the path if nothing is listening on it any more
+            probe = socket.socket(_AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+                raise OSError(f"Socket already in use: {socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(socket_path)
+            finally:
+                probe.close()
+        server = socket.socket(_AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        return server, {"transport": "unix", "socket": socket_path}
+
+    host = _listen_config.get("host") or os.environ.get(ENV_HOST) or HOST
+    port = _listen_config.get("port")
+    if port is None:
+        port = os.environ.get(ENV_PORT) or PORT
+    last_error = None
+    for candidate in _parse_ports(port):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server.bind((host, candidate))
+        except OSError as e:
+            server.close()
+            last_error = e
+            continue
+        return server, {"transport": "tcp", "host": host, "port": server.getsockname()[1]}
+    raise OSError(f"No free port in {port}: {last_error}")
+
+
+def _game_version():
+    """config.version of the running game, if Ren'Py has defined it."""
+    try:
+        import renpy
+        return renpy.config.version
+    except Exception:
+        return None
+
+
+def _write_discovery():
+    """Publish this instance's address for launchers; see discover()."""
+    global _discovery_path
+    directory = _listen_config.get("discovery_dir") or os.environ.get(ENV_DISCOVERY_DIR) or DISCOVERY_DIR
+    info = dict(_address)
+    info.update({
+        "pid": os.getpid(),
+        "game": "Forge the Kingdom",
+        "version": _game_version(),
+        "instance": os.environ.get(ENV_INSTANCE),
+        "started": time.time(),
+    })
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp, path)
+        _discovery_path = path
+    except Exception as e:
+        print(f"[GamePilot] Could not write discovery file: {e}")
+
+
+def _remove_discovery():
+    """Remove this instance's discovery file and Unix socket, if any."""
+    global _discovery_path
+    paths = [_discovery_path]
+    if _address and _address.get("transport") == "unix":
+        paths.append(_address["socket"])
+    for path in paths:
+        if path:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    _discovery_path = None
+
+
+def discover(directory=None):
+    """List running bridge instances from their discovery files.
+
+    Files left behind by processes that no longer exist are skipped.
+    """
+    directory = directory or os.environ.get(ENV_DISCOVERY_DIR) or DISCOVERY_DIR
+    instances = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return instances
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                info = json.load(f)
+            if not _pid_alive(int(info["pid"])):
+                continue
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+        instances.append(info)
+    return instances
+
+
+def _pid_alive(pid):
+    """Whether a process exists, without signalling it.
+
+    On Windows os.kill(pid, 0) would terminate the process, so ask the
+    kernel for its exit code instead.
+    """
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # Access denied still means the process is there
+            return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+        try:
+            code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+            return code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True  # someone else's process
+    except OSError:
+        return False
+    return True
+
+
+def _server_loop():
+    """Main server loop: one selector multiplexes the listener and all clients."""
+    global _selector, _waker_r, _waker_w, _address, _running
+    server = None
+    _selector = selectors.DefaultSelector()
+    _waker_r, _waker_w = socket.socketpair()
+    if _script_index is None:
+        _build_script_index()
+    try:
+        server, _address = _open_listener()
+        server.listen(LISTEN_BACKLOG)
+        server.setblocking(False)
+        _waker_r.setblocking(False)
+        _waker_w.setblocking(False)
+        _selector.register(server, selectors.EVENT_READ, None)
+        _selector.register(_waker_r, selectors.EVENT_READ, None)
+        _write_discovery()
+        where = _address.get("socket") or f"{_address['host']}:{_address['port']}"
+        print(f"[GamePilot] Bridge listening on {where}")
+        last_sweep = time.monotonic()
+        while _running:
+            for key, mask in _selector.select(timeout=1.0):
+                if key.fileobj is server:
+                    _accept(server)
+                elif key.fileobj is _waker_r:
+                    try:
+                        _waker_r.recv(4096)
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    _drain_outbox()
+                else:
+                    _service(key.data, mask)
+            now = time.monotonic()
+            if now - last_sweep >= 1.0:
+                _sweep_idle()
+                last_sweep = now
+    except Exception as e:
+        print(f"[GamePilot] Server error: {e}")
+        traceback.print_exc()
+        # The loop is gone (a bad GAME_PILOT_PORT, say); let start() retry
+        _running = False
+    finally:
+        for client in list(_clients.values()):
+            _close(client)
+        for sock in (server, _waker_r, _waker_w):
+            try:
+                sock.close()
+            except Exception:
+                pass
+        _remove_discovery()
+        try:
+            _selector.close()
+        except Exception:
+            pass
+        print("[GamePilot] Bridge stopped")
+
+
+def _wake():
+    """Interrupt the selector from another thread."""
+    try:
+        _waker_w.send(b"\0")
+    except Exception:
+        pass
+
+
+def start(port=None, host=None, socket_path=None, discovery_dir=None,
+          metrics_path=None, history_path=None):
+    """Start the Game Pilot bridge server.
+
+    Arguments override the GAME_PILOT_* environment variables, which
+    override PORT and HOST.
+    """
+    global _server_thread, _running, _listen_config, _turbo_pending
     if _running:
         print("[GamePilot] Already running")
         return
     _running = True
-    _install_hooks()
+    _listen_config = {
+        "port": port, "host": host,
+        "socket_path": socket_path, "discovery_dir": discovery_dir,
+        "metrics_path": metrics_path,
+    }
+    history_path = history_path or os.environ.get(ENV_HISTORY)
+    if history_path:
+        _history.open_spill(history_path)
+    if not _hooks_installed:
+        _install_hooks()
+    if os.environ.get(ENV_TURBO, "") not in ("", "0"):
+        # Preferences are only safe to touch from the main thread
+        _turbo_pending = True
     _server_thread = threading.Thread(target=_server_loop, daemon=True, name="GamePilot")
     _server_thread.start()
-    print("[GamePilot] Bridge started on port 47201")
+    print("[GamePilot] Bridge started")
 
 
 def stop():
     """Stop the bridge server."""
     global _running
     _running = False
+    _wake()
+    _dump_metrics()
+    _history.close_spill()
+    with _shm_lock:
+        for seg in _shm_segments.values():
+            try:
+                seg.close()
+                seg.unlink()
+            except Exception:
+                pass
+        _shm_segments.clear()
     print("[GamePilot] Bridge stopping...")
@@ -10,26 +10,20 @@ Usage (from Ren'Py):
 
 import os
 import json
-import base64
 import time
 import traceback
 
-# Reuse SSL fix from portrait_generator
+import generation_cache
+import image_stream
+import rate_limiter
+
+# Pooled keep-alive HTTPS client; urllib-based, since requests may not be
+# available in Ren'Py's Python
 try:
-    from urllib.request import Request, urlopen
+    import http_pool
     from urllib.error import HTTPError, URLError
-    import ssl
-    try:
-        _ssl_ctx = ssl.create_default_context()
-        if not _ssl_ctx.get_ca_certs():
-            raise Exception("No CA certs")
-    except Exception:
-        _ssl_ctx = ssl.create_default_context()
-        _ssl_ctx.check_hostname = False
-        _ssl_ctx.verify_mode = ssl.CERT_NONE
     HAS_URLLIB = True
 except ImportError:
-    _ssl_ctx = None
     HAS_URLLIB = False
 
 # ── Config ────────────────────────────────────────────────────────────────
@@ -39,6 +33,7 @@ GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model
 IMAGEN_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:predict"
 SCENE_DIR = os.path.join(os.path.dirname(__file__), "images", "scenes", "custom")
 TIMEOUT = 90  # scenes are larger/more complex than portraits
+ASPECT_RATIO = "16:9"
 
 # ── Trait Descriptions (mirrored from portrait_generator) ─────────────────
 
@@ -214,15 +209,23 @@ def build_scene_prompt(chapter_key, traits):
 
 # ── API Call ──────────────────────────────────────────────────────────────
 
-def generate_scene(chapter_key, traits, api_key, model=None):
+def generate_scene(chapter_key, traits, api_key, model=None, seed=None, reroll=False,
+                   ticket=None, retries=rate_limiter.MAX_RETRIES):
     """
     Generate a chapter scene painting using Gemini image generation.
 
+    A repeat of the same prompt, model and seed returns the cached painting
+    without an API call; reroll=True always paints (and caches) a new one.
+
     Args:
         chapter_key: str — key from SCENE_TEMPLATES (e.g. "survey", "forge")
         traits: dict — player's character_traits from persistent
         api_key: str — Gemini API key
         model: str — model override (default: DEFAULT_MODEL)
+        seed: int — optional generation seed, part of the cache key
+        reroll: bool — skip the cache lookup
+        ticket: rate_limiter.Ticket — follows the wait for a rate-limit slot
+        retries: int — 429 / 503 answers retried before giving up
 
     Returns: (success: bool, path_or_error: str)
         On success: (True, absolute_path_to_image)
@@ -248,16 +251,24 @@ def generate_scene(chapter_key, traits, api_key, model=None):
     _model = model if model else DEFAULT_MODEL
     is_imagen = _model.startswith("imagen")
 
+    cache_key = generation_cache.make_key(_model, prompt, ASPECT_RATIO, seed)
+    if not reroll:
+        cached = generation_cache.fetch(cache_key, SCENE_DIR, os.path.splitext(filename)[0])
+        if cached:
+            return True, cached
+
     if is_imagen:
         url = IMAGEN_API_URL.format(model=_model) + "?key=" + api_key
         payload = {
             "instances": [{"prompt": prompt}],
             "parameters": {
                 "sampleCount": 1,
-                "aspectRatio": "16:9",
+                "aspectRatio": ASPECT_RATIO,
                 "outputOptions": {"mimeType": "image/png"},
             }
         }
+        if seed is not None:
+            payload["parameters"]["seed"] = seed
     else:
         url = GEMINI_API_URL.format(model=_model) + "?key=" + api_key
         payload = {
@@ -267,14 +278,27 @@ def generate_scene(chapter_key, traits, api_key, model=None):
                 "temperature": 1.0,
             }
         }
+        if seed is not None:
+            payload["generationConfig"]["seed"] = seed
 
     headers = {"Content-Type": "application/json"}
 
+    tmp_path = None
     try:
         data = json.dumps(payload).encode("utf-8")
-        req = Request(url, data=data, headers=headers, method="POST")
-        response = urlopen(req, timeout=TIMEOUT, context=_ssl_ctx)
-        result = json.loads(response.read().decode("utf-8"))
+
+        def _send():
+            # The image is decoded to a temp file as it downloads; result
+            # holds image_stream.STREAMED in its place. As before the pool,
+            # a certificate that cannot be verified (no CA store in Ren'Py's
+            # Python) is retried without verification.
+            with http_pool.open_stream("POST", url, body=data, headers=headers,
+                                       timeout=TIMEOUT, insecure_fallback=True) as response:
+                return image_stream.extract(response, SCENE_DIR)
+
+        # Waits its turn under the model's per-minute limit; 429s are retried
+        result, tmp_path = rate_limiter.call(_model, api_key, _send, ticket=ticket,
+                                             retries=retries)
 
         # Extract image — Imagen format
         if is_imagen:
@@ -284,14 +308,13 @@ def generate_scene(chapter_key, traits, api_key, model=None):
             b64_data = predictions[0].get("bytesBase64Encoded", "")
             if not b64_data:
                 return False, "No image data in Imagen response"
-            img_bytes = base64.b64decode(b64_data)
             mime = predictions[0].get("mimeType", "image/png")
             ext = "png" if "png" in mime else "jpg"
             base = os.path.splitext(filename)[0]
             filename = "%s.%s" % (base, ext)
             output_path = os.path.join(SCENE_DIR, filename)
-            with open(output_path, "wb") as f:
-                f.write(img_bytes)
+            image_stream.commit(tmp_path, output_path)
+            generation_cache.store(cache_key, output_path, _model)
             return True, output_path
 
         # Gemini format
@@ -309,7 +332,6 @@ def generate_scene(chapter_key, traits, api_key, model=None):
                 if not b64_data:
                     continue
 
-                img_bytes = base64.b64decode(b64_data)
                 ext = "png"
                 if "jpeg" in mime or "jpg" in mime:
                     ext = "jpg"
@@ -320,9 +342,9 @@ def generate_scene(chapter_key, traits, api_key, model=None):
                 filename = "%s.%s" % (base, ext)
                 output_path = os.path.join(SCENE_DIR, filename)
 
-                with open(output_path, "wb") as f:
-                    f.write(img_bytes)
+                image_stream.commit(tmp_path, output_path)
 
+                generation_cache.store(cache_key, output_path, _model)
                 return True, output_path
 
         return False, "No image data in response"
@@ -341,9 +363,35 @@ def generate_scene(chapter_key, traits, api_key, model=None):
     except Exception as e:
         return False, "Unexpected error: %s\n%s" % (str(e), traceback.format_exc())
 
+    finally:
+        image_stream.discard(tmp_path)
+
 
 # ── Utility ───────────────────────────────────────────────────────────────
 
+def is_cached(chapter_key, traits, model=None, seed=None):
+    """True if generate_scene would return this scene from the cache."""
+    prompt = build_scene_prompt(chapter_key, traits)
+    if not prompt:
+        return False
+    key = generation_cache.make_key(model or DEFAULT_MODEL, prompt, ASPECT_RATIO, seed)
+    return generation_cache.contains(key)
+
+
+def fetch_cached(chapter_key, traits, model=None, seed=None):
+    """Copy a cached scene to a new scene file without touching the network.
+
+    Returns the new path, or None if the scene is not (or no longer) cached.
+    Safe on the Ren'Py main thread.
+    """
+    prompt = build_scene_prompt(chapter_key, traits)
+    if not prompt:
+        return None
+    key = generation_cache.make_key(model or DEFAULT_MODEL, prompt, ASPECT_RATIO, seed)
+    base_name = "scene_%s_%d" % (chapter_key, int(time.time()))
+    return generation_cache.fetch(key, SCENE_DIR, base_name)
+
+
 def get_scene_path(chapter_key):
     """Return the most recent scene path for a chapter, or None."""
     if not os.path.isdir(SCENE_DIR):
@@ -0,0 +1,164 @@
+"""
+Scene Prefetch — Forge the Kingdom
+Paints the next chapter scenes in the background while the player reads,
+so accepting Merith's offer reveals the painting at once. Prefetched scenes
+go into the generation cache only; the offer's own generate_scene call then
+returns them as a cache hit.
+
+Bounded on purpose: one request at a time, at most AHEAD chapters ahead,
+at least MIN_INTERVAL seconds apart (the image models allow only 5-10
+requests a minute), and nothing at all for BACKOFF seconds after a 429 or
+503. Foreground generation always goes first, a request only starts while
+the rate limiter has RESERVE tokens to spare, and a rate-limited prefetch is
+never retried by the limiter, so the player's own request never queues
+behind a prefetch.
+
+Usage:
+    import scene_prefetch
+    scene_prefetch.schedule("survey", traits, api_key, model)  # chapters after survey
+    scene_prefetch.wait("marketplace", traits, model)  # if one is in flight
+"""
+
+import os
+import threading
+import time
+
+import rate_limiter
+import scene_generator as sg
+
+# ── Config ────────────────────────────────────────────────────────────────
+
+AHEAD = 2  # chapters painted ahead of the player
+MIN_INTERVAL = 15.0  # seconds between prefetch requests
+BACKOFF = 300.0  # seconds without prefetching after a rate-limit error
+BACKOFF_STATUSES = ("API error 429", "API error 503")
+RESERVE = 2.0  # rate-limiter tokens left free for the player's requests
+
+_cond = threading.Condition()
+_queue = []  # (chapter_key, traits, api_key, model), oldest first
+_running = None  # (chapter_key, model, prompt) being painted now
+_worker = None
+_last_request = 0.0
+_paused_until = 0.0
+_busy = None  # callable; True while a foreground generation runs
+_stats = {"painted": 0, "failed": 0, "skipped": 0}
+
+
+def upcoming(after=None, count=AHEAD):
+    """The next count chapter keys after `after` (from the first if None)."""
+    keys = list(sg.SCENE_TEMPLATES)
+    start = keys.index(after) + 1 if after in keys else 0
+    return keys[start:start + count]
+
+
+def schedule(after, traits, api_key, model=None, count=AHEAD, busy=None):
+    """Queue the chapters after `after` for painting, replacing older plans.
+
+    busy, if given, is polled before each request; prefetching waits while
+    it returns True.
+    """
+    global _worker, _busy
+    if not traits or not api_key:
+        return
+    with _cond:
+        if busy is not None:
+            _busy = busy
+        _queue[:] = [(key, dict(traits), api_key, model) for key in upcoming(after, count)]
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, daemon=True, name="ScenePrefetch")
+            _worker.start()
+        _cond.notify_all()
+
+
+def cancel():
+    """Drop queued chapters; a request already in flight still finishes."""
+    with _cond:
+        del _queue[:]
+        _cond.notify_all()
+
+
+def _same(running, chapter_key, traits, model):
+    return running is not None and running == (
+        chapter_key, model or sg.DEFAULT_MODEL, sg.build_scene_prompt(chapter_key, traits))
+
+
+def wait(chapter_key, traits, model=None, timeout=None):
+    """Block while this exact scene is being prefetched.
+
+    Returns True if it was in flight (its result, if any, is now cached).
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _cond:
+        if not _same(_running, chapter_key, traits, model):
+            return False
+        while _same(_running, chapter_key, traits, model):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            _cond.wait(remaining)
+        return True
+
+
+def _next_job():
+    """Wait for a job that may run now and mark it running. Call with _cond held."""
+    global _running, _last_request
+    while True:
+        if not _queue:
+            return None
+        now = time.monotonic()
+        ready_at = max(_last_request + MIN_INTERVAL, _paused_until)
+        if now < ready_at:
+            _cond.wait(ready_at - now)
+            continue
+        if _busy is not None and _busy():
+            _cond.wait(1.0)
+            continue
+        chapter_key, traits, api_key, model = _queue[0]
+        if rate_limiter.headroom(model or sg.DEFAULT_MODEL, api_key) < RESERVE:
+            _cond.wait(MIN_INTERVAL)
+            continue
+        _queue.pop(0)
+        if sg.is_cached(chapter_key, traits, model):
+            _stats["skipped"] += 1
+            continue
+        _running = (chapter_key, model or sg.DEFAULT_MODEL,
+                    sg.build_scene_prompt(chapter_key, traits))
+        _last_request = now
+        return chapter_key, traits, api_key, model
+
+
+def _run():
+    global _running, _paused_until
+    while True:
+        with _cond:
+            job = _next_job()
+            if job is None:
+                return
+        chapter_key, traits, api_key, model = job
+        ok, result = False, ""
+        try:
+            # No limiter retries: a retry would wait at the head of the
+            # queue, ahead of the player; back off here instead
+            ok, result = sg.generate_scene(chapter_key, traits, api_key, model=model, retries=0)
+            if ok:
+                # Keep only the cache's copy until the player asks for it
+                os.remove(result)
+        except Exception as e:
+            result = str(e)
+        with _cond:
+            _running = None
+            if ok:
+                _stats["painted"] += 1
+            else:
+                _stats["failed"] += 1
+                print("[ScenePrefetch] %s failed: %s" % (chapter_key, str(result)[:200]))
+                if str(result).startswith(BACKOFF_STATUSES):
+                    _paused_until = time.monotonic() + BACKOFF
+            _cond.notify_all()
+
+
+def stats():
+    """Counts of painted, failed and already-cached chapters, and the queue."""
+    with _cond:
+        return dict(_stats, queued=[job[0] for job in _queue],
+                    running=_running[0] if _running else None)
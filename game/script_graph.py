@@ -0,0 +1,249 @@
+"""
+Script Graph — Forge the Kingdom
+Reads the game's .rpy sources once and indexes every label (file and line)
+and the jumps, calls and fall-throughs between them, so tools can plan a
+route through the story without playing it. Pure Python; needs no Ren'Py.
+
+Usage:
+    import script_graph
+    index = script_graph.build_index("game")
+    index["labels"]["accept_crown"]  # {"file": "script.rpy", "line": 623, ...}
+    index["edges"]                   # [{"from": "start", "to": "accept_crown", ...}]
+"""
+
+import os
+import re
+
+# Top-level statements whose blocks are not story flow
+SKIPPED_BLOCKS = (
+    "init", "python", "screen", "style", "transform", "define", "default",
+    "image", "translate", "testcase",
+)
+
+_LABEL_RE = re.compile(r"label\s+(\.?[\w.]+)\s*(?:\((.*)\))?\s*(?:hide\s*)?:$")
+_MENU_RE = re.compile(r"menu(?:\s+(\.?[\w.]+))?\s*(?:\(.*\))?\s*:$")
+_JUMP_RE = re.compile(r"(jump|call)\s+(?:(expression)\s+(.+?)|(\.?[\w.]+))"
+                      r"(?:\s*\(.*\))?(?:\s+pass)?(?:\s+from\s+\w+)?\s*$")
+_CHOICE_RE = re.compile(r"(\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*')\s*(?:\(.*\))?\s*(?:if\s+.+)?:$")
+
+
+class _Node:
+    """One logical line of a .rpy file and the block indented under it."""
+
+    __slots__ = ("indent", "text", "line", "children")
+
+    def __init__(self, indent, text, line):
+        self.indent = indent
+        self.text = text
+        self.line = line
+        self.children = []
+
+    @property
+    def word(self):
+        return self.text.split(None, 1)[0].rstrip(":")
+
+
+def _open_brackets(text, depth=0):
+    """Bracket depth after text, ignoring brackets inside string literals."""
+    quote = None
+    escaped = False
+    for ch in text:
+        if quote:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == quote:
+                quote = None
+        elif ch in "\"'":
+            quote = ch
+        elif ch == "#":
+            break
+        elif ch in "([{":
+            depth += 1
+        elif ch in ")]}":
+            depth -= 1
+    return depth
+
+
+def _logical_lines(source):
+    """Yield (indent, text, line number), joining bracketed and \\ continuations."""
+    lines = source.splitlines()
+    i = 0
+    while i < len(lines):
+        raw = lines[i].replace("\t", "    ")
+        start = i
+        i += 1
+        text = raw.strip()
+        if not text or text.startswith("#"):
+            continue
+        indent = len(raw) - len(raw.lstrip(" "))
+        depth = _open_brackets(text)
+        while (depth > 0 or text.endswith("\\")) and i < len(lines):
+            more = lines[i].strip()
+            i += 1
+            text = text.rstrip("\\").rstrip() + " " + more
+            depth = _open_brackets(more, depth)
+        yield indent, text, start + 1
+
+
+def _parse(source):
+    """Build the indentation tree of a .rpy file."""
+    root = _Node(-1, "", 0)
+    stack = [root]
+    for indent, text, line in _logical_lines(source):
+        while stack[-1].indent >= indent:
+            stack.pop()
+        node = _Node(indent, text, line)
+        stack[-1].children.append(node)
+        stack.append(node)
+    return root.children
+
+
+def _terminal(block):
+    """True if control never runs off the end of a block."""
+    if not block:
+        return False
+    last = block[-1]
+    if last.word in ("jump", "return"):
+        return True
+    if last.word == "menu":
+        choices = [c for c in last.children if _CHOICE_RE.match(c.text)]
+        return bool(choices) and all(_terminal(c.children) for c in choices)
+    if last.word == "else":
+        # The whole if/elif/else chain must end every branch
+        i = len(block) - 1
+        while i >= 0 and block[i].word in ("if", "elif", "else"):
+            if not _terminal(block[i].children):
+                return False
+            if block[i].word == "if":
+                return True
+            i -= 1
+    return False
+
+
+class _Walker:
+    """Collects labels and edges from the trees of all files."""
+
+    def __init__(self):
+        self.labels = {}
+        self.edges = []
+
+    def define(self, name, node, path, scope, parameters=None, menu=False):
+        if name.startswith("."):
+            name = scope + name
+        self.labels.setdefault(name, {
+            "file": path,
+            "line": node.line,
+            "parameters": parameters,
+            "menu": menu,
+        })
+        return name
+
+    def edge(self, source, target, kind, path, node, caption=None, expression=None):
+        if source is None:
+            return
+        edge = {"from": source, "to": target, "kind": kind,
+                "file": path, "line": node.line}
+        if caption is not None:
+            edge["caption"] = caption
+        if expression is not None:
+            edge["expression"] = expression
+        self.edges.append(edge)
+
+    def walk_file(self, nodes, path):
+        previous = None  # last top-level label and its block
+        for node in nodes:
+            match = _LABEL_RE.match(node.text) if node.word == "label" else None
+            if match is None:
+                previous = None
+                continue
+            name = self.define(match.group(1), node, path, "", self._params(match.group(2)))
+            if previous is not None and not _terminal(previous.children):
+                self.edge(self._source_of(previous), name, "next", path, node)
+            previous = node
+            self.walk(node.children, path, name, name.split(".")[0], None)
+
+    def _source_of(self, node):
+        name = _LABEL_RE.match(node.text).group(1)
+        source = name
+        for child in node.children:
+            # Flow at the end of a block belongs to the last nested label
+            if child.word == "label":
+                sub = _LABEL_RE.match(child.text)
+                if sub:
+                    source = self._qualify(sub.group(1), name.split(".")[0])
+        return source
+
+    @staticmethod
+    def _qualify(name, scope):
+        return scope + name if name.startswith(".") else name
+
+    @staticmethod
+    def _params(text):
+        if text is None:
+            return None
+        return [p.strip().split("=")[0].strip() for p in text.split(",") if p.strip()]
+
+    def walk(self, nodes, path, source, scope, caption):
+        for i, node in enumerate(nodes):
+            word = node.word
+            if word == "label":
+                match = _LABEL_RE.match(node.text)
+                if match is None:
+                    continue
+                name = self.define(match.group(1), node, path, scope,
+                                   self._params(match.group(2)))
+                if not _terminal(nodes[:i]):
+                    self.edge(source, name, "next", path, node, caption)
+                self.walk(node.children, path, name, name.split(".")[0], None)
+                source = name
+            elif word in ("jump", "call"):
+                match = _JUMP_RE.match(node.text)
+                if match is None or node.text.startswith("call screen"):
+                    continue
+                kind, expression, target = match.group(1), match.group(3), match.group(4)
+                if target is not None:
+                    target = self._qualify(target, scope)
+                self.edge(source, target, kind, path, node, caption, expression)
+            elif word == "menu":
+                match = _MENU_RE.match(node.text)
+                if match and match.group(1):
+                    self.define(match.group(1), node, path, scope, menu=True)
+                for child in node.children:
+                    choice = _CHOICE_RE.match(child.text)
+                    if choice:
+                        self.walk(child.children, path, source, scope, choice.group(1)[1:-1])
+            elif word in ("python", "init") or word.startswith("$"):
+                continue
+            elif node.children:
+                self.walk(node.children, path, source, scope, caption)
+
+
+def build_index(game_dir):
+    """Index labels and the jump/call graph of every .rpy file under game_dir.
+
+    Returns {"labels": {name: {"file", "line", "parameters", "menu"}},
+    "edges": [{"from", "to", "kind", "file", "line", ...}]}. Edge kinds are
+    "jump", "call" and "next" (falling off the end of a block into the
+    following label); edges made inside a menu choice carry its "caption",
+    and `jump expression` edges have "to" None and the "expression" text.
+    Paths are relative to game_dir.
+    """
+    walker = _Walker()
+    for root, dirs, files in os.walk(game_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith(".rpy"):
+                continue
+            full = os.path.join(root, name)
+            path = os.path.relpath(full, game_dir).replace(os.sep, "/")
+            try:
+                with open(full, encoding="utf-8") as f:
+                    source = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"[ScriptGraph] Could not read {path}: {e}")
+                continue
+            nodes = [n for n in _parse(source) if n.word not in SKIPPED_BLOCKS]
+            walker.walk_file(nodes, path)
+    return {"labels": walker.labels, "edges": walker.edges}
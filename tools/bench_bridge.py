@@ -0,0 +1,216 @@
+"""
+Load generator — Game Pilot bridge
+Runs the bridge against the Ren'Py stand-in in tools/fake_renpy (a
+main-thread frame loop playing a small looping story), then points N client
+processes at it, each sending a weighted mix of commands for a fixed time.
+Reports throughput, per-command tail latency and the bridge's own metrics.
+Needs no Ren'Py.
+
+Usage:
+    python tools/bench_bridge.py
+    python tools/bench_bridge.py --clients 32 --duration 20 --depth 4
+    python tools/bench_bridge.py --mix state_since=50,set_variable=10 --fps 30
+    python tools/bench_bridge.py --port 47201 --clients 8   # a real game
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, "..", "game"))
+sys.path.insert(0, os.path.join(HERE, "fake_renpy"))
+
+# Weights of the default mix: mostly snapshot reads, as a pilot polls
+DEFAULT_MIX = {
+    "state_since": 30,
+    "state": 15,
+    "variables": 15,
+    "choices": 10,
+    "ping": 10,
+    "history": 10,
+    "set_variable": 5,
+    "advance": 5,
+}
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def make_request(kind, client, rng, seen):
+    """The request for one mix entry; `seen` carries the last state version."""
+    if kind == "state_since":
+        return {"cmd": "state", "since_version": seen.get("version", 0)}
+    if kind == "variables":
+        return {"cmd": "variables", "names": ["chapter", "forge_lit", "player_name"]}
+    if kind == "history":
+        return {"cmd": "history", "since": seen.get("history", 0), "limit": 50}
+    if kind == "set_variable":
+        return {"cmd": "set_variable", "name": f"bench_{client}", "value": rng.randrange(1000)}
+    return {"cmd": kind}
+
+
+def client_main(address, client, mix, duration, depth, results):
+    """One client process: keep `depth` requests in flight until time is up."""
+    rng = random.Random(client)
+    kinds, weights = zip(*mix.items())
+    if "socket" in address:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address["socket"])
+    else:
+        sock = socket.create_connection((address["host"], address["port"]))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    reader = sock.makefile("rb")
+    latencies = collections.defaultdict(list)
+    errors = collections.Counter()
+    seen = {}
+    pending = {}
+    next_id = 0
+    end = time.perf_counter() + duration
+
+    def send():
+        nonlocal next_id
+        kind = rng.choices(kinds, weights)[0]
+        request = make_request(kind, client, rng, seen)
+        request["id"] = next_id
+        pending[next_id] = (kind, time.perf_counter())
+        next_id += 1
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+    try:
+        for _ in range(depth):
+            send()
+        while pending:
+            line = reader.readline()
+            if not line:
+                errors["closed"] += 1
+                break
+            response = json.loads(line)
+            if "id" not in response:
+                continue
+            kind, sent = pending.pop(response["id"])
+            latencies[kind].append((time.perf_counter() - sent) * 1e3)
+            if not response.get("ok"):
+                errors[f"{kind}: {response.get('error')}"] += 1
+            elif kind.startswith("state"):
+                seen["version"] = response.get("version", seen.get("version", 0))
+            elif kind == "history":
+                seen["history"] = response.get("next", 0)
+            if time.perf_counter() < end:
+                send()
+    finally:
+        sock.close()
+    results.put((dict(latencies), dict(errors)))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def start_fake(fps, auto_advance):
+    """Start the stand-in frame loop and the bridge in this process."""
+    import renpy
+    import renpy_bridge
+    renpy.run_in_thread(fps=fps, auto_advance=auto_advance)
+    renpy_bridge.start(port=0, discovery_dir=tempfile.mkdtemp(prefix="bench-bridge-"))
+    for _ in range(200):
+        if renpy_bridge._address:
+            return renpy_bridge, dict(renpy_bridge._address)
+        time.sleep(0.01)
+    raise SystemExit("Bridge did not start listening")
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, sep, weight = item.partition("=")
+        if not sep:
+            raise SystemExit(f"Expected NAME=WEIGHT, got {item!r}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--depth", type=int, default=1, help="requests in flight per client")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="comma-separated NAME=WEIGHT; names are commands, plus state_since")
+    parser.add_argument("--fps", type=float, default=60, help="stand-in frame rate")
+    parser.add_argument("--auto-advance", type=float, default=0.05,
+                        help="seconds before the stand-in dismisses a line by itself")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="load a running game instead of the stand-in")
+    parser.add_argument("--json", help="write the report here")
+    args = parser.parse_args(argv)
+
+    bridge = None
+    if args.port is None:
+        bridge, address = start_fake(args.fps, args.auto_advance)
+    else:
+        address = {"host": args.host, "port": args.port}
+    where = address.get("socket") or f"{address['host']}:{address['port']}"
+    print(f"{args.clients} clients x depth {args.depth} for {args.duration:g} s against {where}")
+
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=client_main,
+                                     args=(address, i, args.mix, args.duration, args.depth, results))
+             for i in range(args.clients)]
+    start = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    merged = collections.defaultdict(list)
+    errors = collections.Counter()
+    for _ in procs:
+        latencies, errs = results.get()
+        for kind, values in latencies.items():
+            merged[kind].extend(values)
+        errors.update(errs)
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(v) for v in merged.values())
+    report = {"clients": args.clients, "depth": args.depth, "duration_s": round(elapsed, 2),
+              "requests": total, "throughput": round(total / elapsed, 1),
+              "errors": dict(errors), "commands": {}}
+    header = "".join(f"{'p' + format(p, 'g'):>9}" for p in PERCENTILES)
+    print(f"\n  {'command':<14} {'count':>8} {'rate/s':>9}{header} {'max':>9}")
+    for kind in sorted(merged, key=lambda k: -len(merged[k])):
+        values = sorted(merged[kind])
+        row = {"count": len(values), "rate": round(len(values) / elapsed, 1),
+               "max": round(values[-1], 2)}
+        for p in PERCENTILES:
+            row[f"p{p:g}"] = round(percentile(values, p), 2)
+        report["commands"][kind] = row
+        cells = "".join(f"{row[f'p{p:g}']:>9.2f}" for p in PERCENTILES)
+        print(f"  {kind:<14} {row['count']:>8} {row['rate']:>9.1f}{cells} {row['max']:>9.2f}")
+    everything = sorted(v for values in merged.values() for v in values)
+    cells = "".join(f"{percentile(everything, p):>9.2f}" for p in PERCENTILES)
+    print(f"  {'all':<14} {total:>8} {total / elapsed:>9.1f}{cells} "
+          f"{(everything[-1] if everything else 0):>9.2f}  (ms)")
+    for error, count in errors.most_common(10):
+        print(f"  error x{count}: {error}")
+
+    if bridge is not None:
+        metrics = bridge._metrics.snapshot()
+        report["bridge"] = metrics
+        bridge.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Framer micro-benchmark — Game Pilot bridge
+Feeds the bridge's request framer 1-byte chunks and large pipelined batches
+at growing sizes, next to the old split-and-reparse loop, to show how each
+scales. Needs no Ren'Py.
+
+Usage:
+    python tools/bench_framer.py
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "game"))
+
+import renpy_bridge  # noqa: E402
+
+
+def legacy_feed(chunks):
+    """The pre-framer loop: bytes concat, split, speculative json.loads."""
+    buf = b""
+    count = 0
+    for chunk in chunks:
+        buf += chunk
+        while b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            if line.strip():
+                count += 1
+        if buf and b"\n" not in buf:
+            try:
+                json.loads(buf.decode("utf-8"))
+                count += 1
+                buf = b""
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+    return count
+
+
+def framer_feed(chunks):
+    """The current framer, as _handle_client drives it."""
+    framer = renpy_bridge._LineFramer(max_size=64 << 20)
+    count = 0
+    for chunk in chunks:
+        framer.feed(chunk)
+        for line in framer.messages():
+            if line is not None and line.strip():
+                count += 1
+    return count
+
+
+def one_byte_chunks(size):
+    """One request of roughly `size` bytes, delivered a byte at a time."""
+    msg = json.dumps({"cmd": "set_variable", "name": "quest_log",
+                      "value": "x" * size}).encode("utf-8") + b"\n"
+    return [msg[i:i + 1] for i in range(len(msg))]
+
+
+def pipelined_batch(count):
+    """`count` small requests arriving in a single recv."""
+    line = json.dumps({"cmd": "state", "since_version": 12}).encode("utf-8") + b"\n"
+    return [line * count]
+
+
+def timed(fn, chunks, expected):
+    start = time.perf_counter()
+    got = fn(chunks)
+    elapsed = time.perf_counter() - start
+    assert got == expected, (fn.__name__, got, expected)
+    return elapsed
+
+
+def run(title, make, sizes, expected):
+    print(title)
+    print(f"  {'size':>8}  {'legacy':>10}  {'framer':>10}  {'framer ns/byte':>15}")
+    for size in sizes:
+        chunks = make(size)
+        total = sum(len(c) for c in chunks)
+        legacy = timed(legacy_feed, chunks, expected(size))
+        framer = timed(framer_feed, chunks, expected(size))
+        print(f"  {size:>8}  {legacy * 1e3:>8.1f}ms  {framer * 1e3:>8.1f}ms  "
+              f"{framer / total * 1e9:>15.1f}")
+    print()
+
+
+if __name__ == "__main__":
+    run("One message in 1-byte chunks (message size in bytes)",
+        one_byte_chunks, [2000, 4000, 8000, 16000], lambda n: 1)
+    run("Pipelined batch in one chunk (message count)",
+        pipelined_batch, [5000, 10000, 20000, 40000], lambda n: n)
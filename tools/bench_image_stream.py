@@ -0,0 +1,157 @@
+"""
+Image download memory benchmark — Forge the Kingdom
+Serves a Gemini-style response carrying a 4K scene from a local HTTP server
+and saves it twice, each in a fresh process: once the old way (read the
+body, json.loads it, b64decode the string, write) and once through
+http_pool.open_stream + image_stream.extract. Prints each process's peak RSS
+growth and wall time. Needs no network and no API key.
+
+Usage:
+    python tools/bench_image_stream.py
+    python tools/bench_image_stream.py --megabytes 24 --gzip
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "game"))
+
+# A 3840x2160 PNG of a detailed painting is typically 10-20 MB
+DEFAULT_MEGABYTES = 16
+
+
+def make_response(size):
+    """A generateContent response with one inlineData image of size bytes."""
+    image = os.urandom(size)
+    body = json.dumps({
+        "candidates": [{
+            "content": {"parts": [
+                {"text": "Here is your scene."},
+                {"inlineData": {"mimeType": "image/png",
+                                "data": base64.b64encode(image).decode("ascii")}},
+            ]},
+            "finishReason": "STOP",
+        }],
+    }).encode("utf-8")
+    return body, image
+
+
+def serve(body, use_gzip):
+    payload = gzip.compress(body, compresslevel=1) if use_gzip else body
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            # Like Google, only gzip for clients that ask
+            zipped = use_gzip and "gzip" in self.headers.get("Accept-Encoding", "")
+            data = payload if zipped else body
+            if zipped:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def peak_rss_mb():
+    # Linux carries ru_maxrss over from the parent across fork + exec, so
+    # prefer this process's own high-water mark
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def save_buffered(url, out_path):
+    """What generate_scene did before: three full copies of the image."""
+    from urllib.request import Request, urlopen
+    req = Request(url, data=b"{}", headers={"Content-Type": "application/json"}, method="POST")
+    response = urlopen(req, timeout=60)
+    result = json.loads(response.read().decode("utf-8"))
+    part = result["candidates"][0]["content"]["parts"][1]["inlineData"]
+    with open(out_path, "wb") as f:
+        f.write(base64.b64decode(part["data"]))
+
+
+def save_streamed(url, out_path):
+    import http_pool
+    import image_stream
+    with http_pool.open_stream("POST", url, body=b"{}",
+                               headers={"Content-Type": "application/json"}) as response:
+        result, tmp_path = image_stream.extract(response, os.path.dirname(out_path))
+    assert result["candidates"][0]["content"]["parts"][1]["inlineData"]["data"] == image_stream.STREAMED
+    image_stream.commit(tmp_path, out_path)
+
+
+def child(mode, url, out_path):
+    """Run one download in this process and print its measurements."""
+    import http_pool  # noqa: F401 — import costs are not part of the download
+    import image_stream  # noqa: F401
+    from urllib.request import urlopen  # noqa: F401
+    before = peak_rss_mb()
+    start = time.perf_counter()
+    (save_buffered if mode == "buffered" else save_streamed)(url, out_path)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"before": before, "peak": peak_rss_mb(), "seconds": elapsed}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2])
+    parser.add_argument("--megabytes", type=float, default=DEFAULT_MEGABYTES,
+                        help="decoded image size")
+    parser.add_argument("--gzip", action="store_true",
+                        help="gzip the response for clients that accept it")
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "URL", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(*args.child)
+        return
+
+    body, image = make_response(int(args.megabytes * 1024 * 1024))
+    server = serve(body, args.gzip)
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1beta/models/x:generateContent"
+    print(f"Image {len(image) / 1e6:.1f} MB, response {len(body) / 1e6:.1f} MB"
+          f"{' (gzip)' if args.gzip else ''}")
+    print(f"  {'mode':<10} {'peak RSS growth':>16} {'time':>8}")
+    with tempfile.TemporaryDirectory() as out_dir:
+        for mode in ("buffered", "streamed"):
+            out_path = os.path.join(out_dir, f"{mode}.png")
+            output = subprocess.check_output(
+                [sys.executable, __file__, "--child", mode, url, out_path])
+            stats = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+            with open(out_path, "rb") as f:
+                assert f.read() == image, f"{mode} wrote a different image"
+            print(f"  {mode:<10} {stats['peak'] - stats['before']:>13.1f} MB "
+                  f"{stats['seconds'] * 1e3:>6.0f} ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Ren'Py stand-in — Game Pilot bridge
+Just enough of the `renpy` package for renpy_bridge to run without the
+engine: config callbacks, the store, the choice screen, jumps, the
+invoke_in_main_thread queue, preferences, persistent data, checkpoints and
+a main-thread frame loop that plays a small scripted story.
+
+The frame loop is what makes the numbers meaningful: like the engine, it
+only runs queued main-thread calls once per frame, and each frame costs
+FRAME_WORK seconds of busy time.
+
+Usage:
+    sys.path.insert(0, "tools/fake_renpy")
+    import renpy
+    renpy.run_in_thread(fps=60, auto_advance=0.05)
+    import renpy_bridge
+    renpy_bridge.start(port=0)
+"""
+
+import collections
+import os
+import pickle
+import threading
+import time
+import types
+
+# A story as a list of statements: ("label", name), ("say", who, what),
+# ("menu", [(caption, target label), ...]), ("set", name, value),
+# ("jump", label) and ("pause",). The default loops forever.
+SCRIPT = [
+    ("label", "start"),
+    ("say", "n", "The Forge Kingdom lies in ruins."),
+    ("say", "merith", "That was... mostly my fault."),
+    ("set", "chapter", 1),
+    ("label", "crossroads"),
+    ("say", "n", "Two roads lead from the square."),
+    ("menu", [("Take the forge road.", "forge_road"), ("Take the tower road.", "tower_road")]),
+    ("label", "forge_road"),
+    ("set", "forge_lit", True),
+    ("say", "n", "The forge glows again."),
+    ("pause",),
+    ("jump", "crossroads"),
+    ("label", "tower_road"),
+    ("set", "chapter", 2),
+    ("say", "merith", "Mind the scorch marks."),
+    ("jump", "crossroads"),
+]
+
+FPS = 60
+FRAME_WORK = 0.002  # busy time per frame, standing in for rendering
+
+
+class JumpException(Exception):
+    """Raised by jump(); the frame loop moves the script to the label."""
+
+
+class RestartContext(Exception):
+    """Raised when a checkpoint is restored."""
+
+
+class _Config:
+    def __init__(self):
+        self.all_character_callbacks = []
+        self.interact_callbacks = []
+        self.label_callbacks = []
+        self.say_menu_text_filter = None
+        self.screen_width = 1920
+        self.screen_height = 1080
+        self.version = "0.1.0"
+        # The real game's sources, so the bridge's script index has work to do
+        self.gamedir = os.path.normpath(os.path.join(
+            os.path.dirname(__file__), "..", "..", "..", "game"))
+
+
+config = _Config()
+store = types.SimpleNamespace(
+    chapter=0, player_name="Player", kingdom_name="Forge", forge_lit=False,
+    quest_log=[],
+)
+
+
+class _ChoiceItem:
+    def __init__(self, caption, action):
+        self.caption = caption
+        self.action = action
+
+
+class _Screen:
+    def __init__(self, items):
+        self.scope = {"items": items}
+
+
+_screens = {}
+_invoke_queue = collections.deque()
+_events = collections.deque()
+
+
+def invoke_in_main_thread(fn, *args):
+    """Queue fn for the next frame, as the engine does."""
+    _invoke_queue.append((fn, args))
+
+
+def queue_event(name):
+    _events.append(name)
+
+
+def jump(label):
+    raise JumpException(label)
+
+
+def pause(delay=None, hard=False):
+    return False
+
+
+class _Script:
+    def __init__(self):
+        self.load(SCRIPT)
+
+    def load(self, statements):
+        self.statements = list(statements)
+        self.namemap = {s[1]: i for i, s in enumerate(self.statements) if s[0] == "label"}
+
+    def has_label(self, label):
+        return label in self.namemap
+
+
+class _Context:
+    def __init__(self):
+        self.current = None
+
+
+class _Log:
+    """Rollback log: freeze/unfreeze the script position and the store."""
+
+    def freeze(self, wait_for_rollback=None):
+        return {"pc": _player.checkpoint_pc, "store": dict(vars(store))}
+
+    def unfreeze(self, roots, label=None):
+        _player.restore = roots
+        raise RestartContext()
+
+
+_context = _Context()
+game = types.SimpleNamespace(
+    script=_Script(),
+    context=lambda: _context,
+    preferences=types.SimpleNamespace(transitions=2, text_cps=40),
+    persistent=types.SimpleNamespace(install_mode=None, onboarding_complete=False,
+                                     character_created=False),
+    log=_Log(),
+    JumpException=JumpException,
+    RestartContext=RestartContext,
+)
+store.persistent = game.persistent
+
+loadsave = types.SimpleNamespace(
+    dump=lambda obj, f: f.write(pickle.dumps(obj)),
+    loads=lambda data: (pickle.loads(data)[0], _Log()),
+)
+
+
+def _run_action(action):
+    action()
+
+
+display = types.SimpleNamespace(
+    screen=types.SimpleNamespace(get_screen=lambda name: _screens.get(name)),
+    behavior=types.SimpleNamespace(run=_run_action),
+    interface=types.SimpleNamespace(act=lambda name: queue_event(name)),
+    draw=types.SimpleNamespace(screenshot=lambda region: None),
+)
+
+_music = types.SimpleNamespace(play=lambda *a, **k: None, queue=lambda *a, **k: None,
+                               stop=lambda *a, **k: None)
+audio = types.SimpleNamespace(music=_music)
+music = _music
+
+
+def display_menu(items, interact=True):
+    """Show (caption, value) items on the choice screen; the chosen value."""
+    chosen = []
+    _screens["choice"] = _Screen([
+        _ChoiceItem(caption, (lambda v=value: chosen.append(v)))
+        for caption, value in items
+    ])
+    try:
+        if _player.interact(lambda: chosen) and chosen:
+            return chosen[0]
+    finally:
+        _screens.pop("choice", None)
+    return None
+
+
+store.menu = display_menu
+exports = types.SimpleNamespace(pause=pause, display_menu=display_menu)
+
+
+class _Player:
+    """Plays SCRIPT on the frame loop thread, the stand-in main thread."""
+
+    def __init__(self, fps, auto_advance):
+        self.frame = 1.0 / fps
+        self.auto_advance = auto_advance
+        self.pc = 0
+        self.checkpoint_pc = 0  # statement a checkpoint taken now restarts at
+        self.restore = None
+        self.frames = 0
+
+    def goto(self, label):
+        self.pc = game.script.namemap[label]
+
+    def interact(self, done):
+        """Run frames until done() or a dismiss; False if the script moved."""
+        try:
+            for cb in config.interact_callbacks:
+                cb()
+        except JumpException as e:
+            self.goto(str(e))
+            return False
+        started = time.monotonic()
+        while True:
+            frame_start = time.perf_counter()
+            busy_until = frame_start + FRAME_WORK
+            while time.perf_counter() < busy_until:
+                pass
+            self.frames += 1
+            try:
+                while _invoke_queue:
+                    fn, args = _invoke_queue.popleft()
+                    fn(*args)
+            except JumpException as e:
+                self.goto(str(e))
+                return False
+            except RestartContext:
+                roots, self.restore = self.restore, None
+                vars(store).update(roots["store"])
+                self.pc = roots["pc"]
+                return False
+            while _events:
+                if _events.popleft() == "dismiss" and done is None:
+                    return True
+            if done is not None and done():
+                return True
+            if (done is None and self.auto_advance is not None
+                    and time.monotonic() - started >= self.auto_advance):
+                return True
+            time.sleep(max(0.0, self.frame - (time.perf_counter() - frame_start)))
+
+    def step(self):
+        statements = game.script.statements
+        if self.pc >= len(statements):
+            self.interact(lambda: False)
+            return
+        self.checkpoint_pc = self.pc
+        st = statements[self.pc]
+        self.pc += 1
+        kind = st[0]
+        if kind == "label":
+            _context.current = st[1]
+            for cb in config.label_callbacks:
+                cb(st[1], False)
+        elif kind == "say":
+            for cb in config.all_character_callbacks:
+                cb("begin", who=st[1], what=st[2])
+            if self.interact(None):
+                for cb in config.all_character_callbacks:
+                    cb("end", who=st[1], what=st[2])
+        elif kind == "menu":
+            # Menu statements go through store.menu, as in the engine
+            target = store.menu(st[1])
+            if target is not None:
+                self.goto(target)
+        elif kind == "set":
+            setattr(store, st[1], st[2])
+        elif kind == "jump":
+            self.goto(st[1])
+        elif kind == "pause":
+            self.interact(None)
+
+    def loop(self):
+        while True:
+            self.step()
+
+
+_player = None
+
+
+def run_in_thread(fps=FPS, auto_advance=None, script=None):
+    """Start the frame loop on a daemon thread and return it.
+
+    auto_advance dismisses say lines and pauses after that many seconds, so
+    the story keeps moving under load without a pilot driving it.
+    """
+    global _player
+    if script is not None:
+        game.script.load(script)
+    _player = _Player(fps, auto_advance)
+    thread = threading.Thread(target=_player.loop, daemon=True, name="FakeRenPyMain")
+    thread.start()
+    return thread
@@ -0,0 +1,342 @@
+"""
+Playthrough runner — Game Pilot bridge
+Drives a running game through every branch of the story over the bridge,
+depth- or breadth-first, and writes a per-label timing table and a coverage
+summary. Every menu reached is saved as a checkpoint, so each branch starts
+from its menu instead of from `start`.
+
+A choice point is explored once per distinct (label, captions, key
+variables) combination, so the side quest menu is explored again in every
+chapter but a branch that rejoins a path already taken stops there.
+
+Screens the autopilot cannot click through are skipped with detours: on
+entering the label, the runner jumps to another one. The default detour
+takes the default portrait in character creation. `--mode full` runs the
+real installer labels; detour them (or stub the installers) on machines
+that must not be changed.
+
+Usage:
+    python tools/playthrough.py                        # first running instance
+    python tools/playthrough.py --port 47201 --order bfs
+    python tools/playthrough.py --mode story_only --mode full --json report.json
+    python tools/playthrough.py --detour installer_gateway=installer_anthropic_key
+"""
+
+import argparse
+import collections
+import json
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "game"))
+
+import renpy_bridge  # noqa: E402
+
+# Jump from the first label to the second whenever it is entered
+DEFAULT_DETOURS = {
+    "character_creation_flow": "character_creation_use_default",
+}
+
+# Set before each mode starts; install_mode comes from --mode
+DEFAULT_SETUP = {
+    "persistent.onboarding_complete": True,
+}
+
+MODES = ("story_only", "full")
+
+
+class BridgeError(Exception):
+    """The bridge answered a command with ok: false."""
+
+
+class Bridge:
+    """Minimal line-protocol client; one request in flight at a time."""
+
+    def __init__(self, host=None, port=None, socket_path=None, timeout=None):
+        if socket_path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path)
+        else:
+            self.sock = socket.create_connection((host or renpy_bridge.HOST, port))
+        self.sock.settimeout(timeout)
+        self.file = self.sock.makefile("rb")
+
+    def call(self, cmd, **args):
+        args["cmd"] = cmd
+        self.sock.sendall(json.dumps(args).encode("utf-8") + b"\n")
+        line = self.file.readline()
+        if not line:
+            raise BridgeError("Bridge closed the connection")
+        response = json.loads(line.decode("utf-8"))
+        if not response.get("ok"):
+            raise BridgeError(f"{cmd}: {response.get('error')}")
+        return response
+
+    def close(self):
+        self.sock.close()
+
+
+class _Node:
+    """A choice point reached during exploration."""
+
+    def __init__(self, key, checkpoint, captions, label):
+        self.key = key
+        self.checkpoint = checkpoint
+        self.captions = captions
+        self.label = label
+        self.pending = len(captions)
+
+
+class Runner:
+    """Explores one install mode and accumulates its report."""
+
+    def __init__(self, bridge, mode, order="dfs", detours=None, setup=None,
+                 max_branches=500, segment_timeout=20.0, max_lines=2000,
+                 exhaustive=False, turbo=True):
+        self.bridge = bridge
+        self.mode = mode
+        self.order = order
+        self.detours = dict(DEFAULT_DETOURS if detours is None else detours)
+        self.setup = dict(DEFAULT_SETUP, **(setup or {}))
+        self.setup.setdefault("persistent.install_mode", mode)
+        self.max_branches = max_branches
+        self.segment_timeout = segment_timeout
+        self.max_lines = max_lines
+        self.exhaustive = exhaustive
+        self.turbo = turbo
+        self.labels = collections.defaultdict(lambda: {
+            "visits": 0, "interactions": 0, "wall_ms": 0.0, "main_ms": 0.0})
+        self.nodes = {}
+        self.taken = []  # (label, caption) of every option explored
+        self.endings = collections.Counter()  # (reason, label)
+        self.branches = 0
+        self.lines = 0
+        self.checkpoints = 0
+        self.elapsed = 0.0
+        self.cursor = 0  # history seq already counted
+        self.label = None  # last label entered, from history
+
+    def _sync_history(self):
+        """Count label entries from the bridge's history since the last sync."""
+        while True:
+            page = self.bridge.call("history", since=self.cursor)
+            for entry in page["entries"]:
+                if entry["type"] == "label":
+                    self.label = entry["label"]
+                    self.labels[self.label]["visits"] += 1
+            self.cursor = page["next"]
+            if not page["more"]:
+                return
+
+    def _merge(self, profile):
+        # Visits come from history: labels entered between two commands
+        # (right after a choose or jump) are missed by run_until's profile
+        for label, stats in (profile or {}).items():
+            total = self.labels[label]
+            for key in ("interactions", "wall_ms", "main_ms"):
+                total[key] += stats.get(key, 0)
+
+    def advance(self):
+        """Run to the next choice, the end of the branch or a stall."""
+        while True:
+            result = self.bridge.call(
+                "run_until", choice=True, label=sorted(self.detours),
+                max_lines=self.max_lines, timeout=self.segment_timeout, profile=True)
+            self._merge(result.get("profile"))
+            self.lines += result.get("lines", 0)
+            if result["reason"] != "label":
+                return result
+            self.bridge.call("jump", label=self.detours[result["label"]])
+
+    def _key(self, state, captions):
+        return json.dumps([self.label, captions, state.get("variables")],
+                          sort_keys=True)
+
+    def _reach(self, result):
+        """Record where a segment ended; return a new _Node to expand, or None."""
+        self._sync_history()
+        state = self.bridge.call("state")
+        # state's label is the current statement, which is often not a label
+        label = self.label
+        if result["reason"] != "choice":
+            self.endings[(result["reason"], label)] += 1
+            return None
+        captions = [c["caption"] for c in result.get("choices", [])]
+        key = self._key(state, captions)
+        if key in self.nodes and not self.exhaustive:
+            self.endings[("joined", label)] += 1
+            return None
+        name = f"playthrough-{self.mode}-{len(self.nodes)}"
+        try:
+            self.bridge.call("checkpoint", action="save", name=name)
+        except BridgeError as e:
+            print(f"  cannot expand menu in {label}: {e}")
+            self.endings[("unexpanded", label)] += 1
+            return None
+        self.checkpoints += 1
+        node = _Node(key, name, captions, label)
+        self.nodes[key] = node
+        return node
+
+    def _release(self, node):
+        node.pending -= 1
+        if node.pending == 0:
+            self.bridge.call("checkpoint", action="delete", name=node.checkpoint)
+
+    def run(self):
+        """Explore every branch reachable from `start`."""
+        if self.turbo:
+            self.bridge.call("turbo", enabled=True)
+        for name, value in self.setup.items():
+            self.bridge.call("set_variable", name=name, value=value)
+        self.cursor = self.bridge.call("history", limit=0)["last"]
+        self.bridge.call("jump", label="start")
+        start = time.perf_counter()
+
+        frontier = collections.deque()
+
+        def push(node):
+            options = [(node, i) for i in range(len(node.captions))]
+            # Depth-first takes the first option first
+            frontier.extend(reversed(options) if self.order == "dfs" else options)
+
+        root = self._reach(self.advance())
+        if root is not None:
+            push(root)
+        while frontier and self.branches < self.max_branches:
+            node, index = frontier.pop() if self.order == "dfs" else frontier.popleft()
+            self.bridge.call("checkpoint", action="load", name=node.checkpoint)
+            # The load lands after its reply; wait for the menu to be back
+            back = self.bridge.call("run_until", choice=True, timeout=self.segment_timeout)
+            self.branches += 1
+            if back["reason"] != "choice":
+                self.endings[("lost_menu", node.label)] += 1
+                self._release(node)
+                continue
+            self.bridge.call("choose", index=index)
+            self.taken.append((node.label, node.captions[index]))
+            child = self._reach(self.advance())
+            self._release(node)
+            if child is not None:
+                push(child)
+        for node, _ in frontier:
+            self.endings[("not_explored", node.label)] += 1
+        self.elapsed = time.perf_counter() - start
+        return self
+
+    def report(self, all_labels):
+        """The mode's report as a JSON-ready dict."""
+        reached = {label for label, stats in self.labels.items() if stats["visits"]}
+        known = set(all_labels)
+        return {
+            "mode": self.mode,
+            "order": self.order,
+            "elapsed_s": round(self.elapsed, 2),
+            "branches": self.branches,
+            "lines": self.lines,
+            "checkpoints": self.checkpoints,
+            "labels": {label: dict(stats, wall_ms=round(stats["wall_ms"], 2),
+                                   main_ms=round(stats["main_ms"], 2))
+                       for label, stats in self.labels.items() if label is not None},
+            "coverage": {
+                "labels_reached": len(reached & known),
+                "labels_total": len(known),
+                "unreached": sorted(known - reached),
+                "choice_points": len(self.nodes),
+                "options_taken": len(self.taken),
+            },
+            "endings": [{"reason": reason, "label": label, "count": count}
+                        for (reason, label), count in sorted(self.endings.items(),
+                                                             key=lambda i: str(i[0]))],
+        }
+
+
+def print_report(report):
+    cov = report["coverage"]
+    print(f"\nMode {report['mode']} ({report['order']}): {report['branches']} branches, "
+          f"{report['lines']} lines in {report['elapsed_s']} s")
+    print(f"  {'label':<36} {'visits':>6} {'inter.':>7} {'wall ms':>10} "
+          f"{'ms/visit':>9} {'main ms':>10}")
+    rows = sorted(report["labels"].items(), key=lambda i: -i[1]["wall_ms"])
+    for label, stats in rows:
+        per_visit = stats["wall_ms"] / stats["visits"] if stats["visits"] else 0.0
+        print(f"  {label:<36} {stats['visits']:>6} {stats['interactions']:>7} "
+              f"{stats['wall_ms']:>10.1f} {per_visit:>9.1f} {stats['main_ms']:>10.1f}")
+    print(f"  Labels reached: {cov['labels_reached']}/{cov['labels_total']}; "
+          f"choice points: {cov['choice_points']}; options taken: {cov['options_taken']}")
+    if cov["unreached"]:
+        print(f"  Unreached: {', '.join(cov['unreached'])}")
+    for ending in report["endings"]:
+        print(f"  Ended {ending['reason']:<12} at {ending['label']} x{ending['count']}")
+
+
+def _pairs(values, parse):
+    result = {}
+    for item in values or ():
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"Expected NAME=VALUE, got {item!r}")
+        result[name] = parse(value)
+    return result
+
+
+def _json_or_text(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2])
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--socket", help="Unix socket path")
+    parser.add_argument("--mode", action="append", choices=MODES,
+                        help="install mode to explore (repeatable; default story_only)")
+    parser.add_argument("--order", choices=("dfs", "bfs"), default="dfs")
+    parser.add_argument("--max-branches", type=int, default=500)
+    parser.add_argument("--segment-timeout", type=float, default=20.0,
+                        help="seconds without reaching a menu before a branch counts as stalled")
+    parser.add_argument("--exhaustive", action="store_true",
+                        help="re-explore menus already seen with the same key variables")
+    parser.add_argument("--detour", action="append", metavar="LABEL=TARGET",
+                        help="jump to TARGET on entering LABEL (replaces the defaults)")
+    parser.add_argument("--set", action="append", metavar="NAME=JSON",
+                        help="store or persistent.* value to set before starting")
+    parser.add_argument("--no-turbo", action="store_true")
+    parser.add_argument("--json", help="write the full report here")
+    args = parser.parse_args(argv)
+
+    if args.port is None and not args.socket:
+        instances = renpy_bridge.discover()
+        if not instances:
+            raise SystemExit("No running bridge found; pass --port or --socket")
+        info = instances[0]
+        args.host, args.port, args.socket = info.get("host"), info.get("port"), info.get("socket")
+
+    bridge = Bridge(args.host, args.port, args.socket)
+    detours = _pairs(args.detour, str) if args.detour else None
+    all_labels = bridge.call("labels")["labels"]
+    reports = []
+    try:
+        for mode in args.mode or ["story_only"]:
+            runner = Runner(bridge, mode, args.order, detours, _pairs(args.set, _json_or_text),
+                            args.max_branches, args.segment_timeout,
+                            exhaustive=args.exhaustive, turbo=not args.no_turbo)
+            report = runner.run().report(
+                name for name, info in all_labels.items() if not info["menu"])
+            print_report(report)
+            reports.append(report)
+    finally:
+        bridge.close()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"reports": reports, "t": time.time()}, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()